@@ -3,41 +3,327 @@ Pipeline RAG avancé avec support multi-documents et techniques d'optimisation.
 """
 
 import os
+import hashlib
 import time
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import atexit
+import queue
+import multiprocessing
+import threading
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from functools import lru_cache
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Iterator
+import numpy as np
+import tiktoken
+import chromadb
 from langchain_community.vectorstores import Chroma
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_core.embeddings import Embeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain.chains import RetrievalQA
 from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import LLMChainExtractor
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain.retrievers.document_compressors import CrossEncoderReranker
+from langchain_community.cross_encoders import HuggingFaceCrossEncoder
 from langchain.schema import Document
+from langchain_core.caches import BaseCache
+from langchain_community.cache import RedisSemanticCache, SQLiteCache
+from langchain_community.callbacks import get_openai_callback
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 import structlog
-from app.core.database import ChatSession, Document as DBDocument, Conversation, get_db, create_tables
+from app.core.async_utils import run_coroutine
+from app.core.database import ChatSession, Document as DBDocument, Conversation, SessionLocal, create_tables, new_id, bulk_record_conversations
 import uuid
 from datetime import datetime
 
 # Configuration du logger structuré
 logger = structlog.get_logger(__name__)
 
+# Taille des requêtes d'embedding (paramètre batch d'OpenAI) et nombre de requêtes simultanées
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_MAX_CONCURRENCY = 8
+
+# Cache des embeddings : questions en mémoire (LRU), chunks sur disque
+# (dossier propre au LocalFileStore, distinct du diskcache ./cache/embeddings de cache_manager)
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+EMBEDDING_CACHE_PATH = "./cache/chunk_embeddings"
+
+# Découpage en tokens (et non en caractères), aligné sur le tokenizer des embeddings OpenAI
+TOKENIZER_ENCODING = "cl100k_base"
+
+# Client Chroma persistant partagé par le processus, et paramètres HNSW des collections de session
+CHROMA_DB_PATH = "./chroma_db"
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 128
+}
+
+# Modèle de reranking local utilisé pour filtrer le contexte récupéré
+RERANKER_MODEL_NAME = "BAAI/bge-reranker-base"
+
+# Cache des réponses du LLM de la chaîne RAG : sémantique via Redis si REDIS_URL est défini,
+# sinon SQLite local (correspondance exacte)
+LLM_CACHE_PATH = "./cache/llm_cache.db"
+
+# Intervalle minimal (secondes) entre deux écritures de last_activity pour une session
+LAST_ACTIVITY_WRITE_INTERVAL = 60
+
+# File d'écriture des conversations, vidée par lots par un thread de fond
+DB_WRITE_BATCH_SIZE = 50
+DB_WRITE_FLUSH_TIMEOUT = 0.1
+_DB_WRITE_Q: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+_db_writer_thread: Optional[threading.Thread] = None
+_DB_WRITER_LOCK = threading.Lock()
+
+# Création des tables effectuée une seule fois par processus
+_TABLES_READY = False
+_TABLES_LOCK = threading.Lock()
+
+# Compteurs de consultation du cache LLM pour la question en cours (un dict par appel à ask_question).
+# Le dict est partagé par référence : il reste visible malgré les copies de contexte faites par LangChain.
+_LLM_CACHE_STATS: ContextVar[Optional[Dict[str, int]]] = ContextVar("llm_cache_stats", default=None)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings mémoïsés : LRU en mémoire pour les questions, cache disque
+    (clé = contenu du chunk) pour les documents ré-ingérés.
+    """
+    
+    def __init__(self, underlying: OpenAIEmbeddings):
+        self.underlying = underlying
+        self._documents = CacheBackedEmbeddings.from_bytes_store(
+            underlying,
+            LocalFileStore(EMBEDDING_CACHE_PATH),
+            namespace=underlying.model
+        )
+        self._embed_query = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(underlying.embed_query)
+    
+    def embed_query(self, text: str) -> List[float]:
+        return list(self._embed_query(text))
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._documents.embed_documents(texts)
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._documents.aembed_documents(texts)
+
+
+class HitTrackingCache(BaseCache):
+    """Cache LLM qui délègue à un cache existant et compte les consultations et les succès."""
+    
+    def __init__(self, underlying: BaseCache):
+        self.underlying = underlying
+    
+    def lookup(self, prompt: str, llm_string: str):
+        value = self.underlying.lookup(prompt, llm_string)
+        stats = _LLM_CACHE_STATS.get()
+        if stats is not None:
+            stats["lookups"] += 1
+            if value is not None:
+                stats["hits"] += 1
+        return value
+    
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        self.underlying.update(prompt, llm_string, return_val)
+    
+    def clear(self, **kwargs: Any) -> None:
+        self.underlying.clear(**kwargs)
+
+
+class AdaptiveCompressionRetriever(ContextualCompressionRetriever):
+    """Retriever à compression qui n'appelle le compresseur que s'il y a des documents à écarter."""
+    
+    threshold: int
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        docs = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()}, **kwargs)
+        if len(docs) <= self.threshold:
+            return docs
+        return list(self.base_compressor.compress_documents(docs, query, callbacks=run_manager.get_child()))
+    
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       **kwargs: Any) -> List[Document]:
+        docs = await self.base_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()}, **kwargs)
+        if len(docs) <= self.threshold:
+            return docs
+        return list(await self.base_compressor.acompress_documents(docs, query, callbacks=run_manager.get_child()))
+
+
+@lru_cache(maxsize=None)
+def _get_reranker(top_n: int) -> CrossEncoderReranker:
+    """Reranker cross-encoder partagé entre toutes les sessions (modèle chargé une seule fois)."""
+    logger.info("Loading cross-encoder reranker", model=RERANKER_MODEL_NAME, top_n=top_n)
+    return CrossEncoderReranker(
+        model=HuggingFaceCrossEncoder(model_name=RERANKER_MODEL_NAME),
+        top_n=top_n
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_token_encoder() -> tiktoken.Encoding:
+    """Encodeur tiktoken chargé une seule fois par processus."""
+    return tiktoken.get_encoding(TOKENIZER_ENCODING)
+
+
+@lru_cache(maxsize=1)
+def _get_chroma_client() -> chromadb.PersistentClient:
+    """Client Chroma unique : l'index HNSW reste ouvert en mémoire d'une requête à l'autre."""
+    return chromadb.PersistentClient(path=CHROMA_DB_PATH)
+
+
+@lru_cache(maxsize=1)
+def _get_embeddings() -> "CachedEmbeddings":
+    """Client d'embeddings partagé par toutes les sessions (client HTTP et tokenizer chargés une fois)."""
+    return CachedEmbeddings(OpenAIEmbeddings(chunk_size=EMBEDDING_BATCH_SIZE, max_retries=6))
+
+
+@lru_cache(maxsize=1)
+def _get_llm() -> ChatOpenAI:
+    """
+    Client LLM partagé par toutes les sessions.
+    Le cache de réponses est attaché à ce client uniquement (et non via set_llm_cache) :
+    le juge d'évaluation et les agents continuent d'appeler le modèle.
+    """
+    # stream_usage : l'usage en tokens n'est renvoyé en streaming que sur demande
+    return ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, streaming=True, stream_usage=True,
+                      cache=HitTrackingCache(_build_llm_cache()))
+
+
+@contextmanager
+def _db() -> Iterator[Session]:
+    """Session SQLAlchemy empruntée au pool, rendue à la sortie du bloc."""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _ensure_tables():
+    """Crée les tables au premier pipeline construit, puis ne fait plus rien."""
+    global _TABLES_READY
+    if _TABLES_READY:
+        return
+    
+    with _TABLES_LOCK:
+        if not _TABLES_READY:
+            create_tables()
+            _TABLES_READY = True
+
+
+def _db_writer():
+    """Insère les conversations en attente par lots, une transaction par lot."""
+    while True:
+        rows = [_DB_WRITE_Q.get()]
+        try:
+            while len(rows) < DB_WRITE_BATCH_SIZE:
+                rows.append(_DB_WRITE_Q.get(timeout=DB_WRITE_FLUSH_TIMEOUT))
+        except queue.Empty:
+            pass
+        
+        try:
+            with _db() as db:
+                bulk_record_conversations(db, rows)
+                # Une seule mise à jour de last_activity pour toutes les sessions du lot
+                db.execute(
+                    update(ChatSession)
+                    .where(ChatSession.id.in_({row["session_id"] for row in rows}))
+                    .values(last_activity=datetime.utcnow())
+                )
+                db.commit()
+        except Exception as e:
+            logger.error("Conversation batch write failed", rows=len(rows), error=str(e))
+        finally:
+            for _ in rows:
+                _DB_WRITE_Q.task_done()
+
+
+def _enqueue_db_write(row: Dict[str, Any]):
+    """Met une conversation en file d'écriture (démarre le thread writer au premier appel)."""
+    global _db_writer_thread
+    if _db_writer_thread is None:
+        with _DB_WRITER_LOCK:
+            if _db_writer_thread is None:
+                _db_writer_thread = threading.Thread(target=_db_writer, name="conversation-writer", daemon=True)
+                _db_writer_thread.start()
+                atexit.register(_DB_WRITE_Q.join)
+    _DB_WRITE_Q.put(row)
+
+
+def _build_llm_cache() -> BaseCache:
+    """Cache des réponses LLM de la chaîne RAG, construit au premier pipeline (Redis a besoin des embeddings)."""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        logger.info("Semantic LLM cache enabled", backend="redis")
+        return RedisSemanticCache(
+            redis_url=redis_url,
+            embedding=_get_embeddings(),
+            score_threshold=0.05
+        )
+    
+    os.makedirs(os.path.dirname(LLM_CACHE_PATH), exist_ok=True)
+    logger.info("LLM cache enabled", backend="sqlite", path=LLM_CACHE_PATH)
+    return SQLiteCache(database_path=LLM_CACHE_PATH)
+
+
+def _file_sha256(path: str) -> str:
+    """Empreinte sha256 du contenu d'un fichier, lu par blocs."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _load_and_split(pdf_path: str, chunk_size: int, chunk_overlap: int) -> Tuple[int, List[Document]]:
+    """
+    Charge un PDF et le découpe en chunks.
+    Fonction de module (picklable) pour pouvoir s'exécuter dans un pool de processus.
+    
+    Returns:
+        Tuple (nombre de pages, chunks)
+    """
+    documents = PyPDFLoader(pdf_path).load()
+    
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=TOKENIZER_ENCODING,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    return len(documents), text_splitter.split_documents(documents)
+
+
 class AdvancedRAGPipeline:
     """Pipeline RAG avancé avec support multi-documents et optimisations."""
     
     def __init__(self, session_id: str = None):
-        self.session_id = session_id or str(uuid.uuid4())
+        self.session_id = session_id or new_id()
         self.vector_store = None
         self.qa_chain = None
-        self.embeddings = OpenAIEmbeddings()
-        self.llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+        self.embeddings = _get_embeddings()
+        self.llm = _get_llm()
         
         # Configuration avancée
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+        self.chunk_size = 400  # en tokens
+        self.chunk_overlap = 60
         self.max_docs_for_context = 5
         self.use_compression = True
         
+        # Horodatage de la dernière écriture de last_activity (throttling)
+        self._last_activity_write = 0.0
+        
         # Métriques
         self.processing_stats = {
             "documents_processed": 0,
@@ -46,14 +332,13 @@ class AdvancedRAGPipeline:
         }
         
         # Créer les tables si nécessaire
-        create_tables()
+        _ensure_tables()
         
         logger.info("Advanced RAG Pipeline initialized", session_id=self.session_id)
 
     def create_or_load_session(self, session_name: str = None) -> str:
         """Crée une nouvelle session ou charge une session existante."""
-        db = next(get_db())
-        try:
+        with _db() as db:
             if session_name:
                 # Vérifier si une session avec ce nom existe déjà
                 existing_session = db.query(ChatSession).filter(
@@ -79,9 +364,6 @@ class AdvancedRAGPipeline:
             
             logger.info("Created new session", session_id=self.session_id, name=session.name)
             return self.session_id
-            
-        finally:
-            db.close()
 
     def process_document(self, pdf_path: str, original_filename: str) -> Dict[str, Any]:
         """
@@ -95,101 +377,14 @@ class AdvancedRAGPipeline:
         
         try:
             # Chargement et découpage du document
-            loader = PyPDFLoader(pdf_path)
-            documents = loader.load()
-            
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap,
-                separators=["\n\n", "\n", " ", ""]
-            )
-            split_docs = text_splitter.split_documents(documents)
-            
-            # Enrichir les métadonnées
-            for i, doc in enumerate(split_docs):
-                doc.metadata.update({
-                    "session_id": self.session_id,
-                    "source_file": original_filename,
-                    "chunk_index": i,
-                    "processing_timestamp": datetime.utcnow().isoformat()
-                })
-            
-            # Créer ou mettre à jour le vector store
-            vector_store_id = f"session_{self.session_id}"
-            chroma_path = f"./chroma_db/{vector_store_id}"
+            pages_count, split_docs = _load_and_split(pdf_path, self.chunk_size, self.chunk_overlap)
             
-            if os.path.exists(chroma_path):
-                # Charger le vector store existant et ajouter les nouveaux documents
-                self.vector_store = Chroma(
-                    persist_directory=chroma_path,
-                    embedding_function=self.embeddings
-                )
-                self.vector_store.add_documents(split_docs)
-            else:
-                # Créer un nouveau vector store
-                self.vector_store = Chroma.from_documents(
-                    documents=split_docs,
-                    embedding=self.embeddings,
-                    persist_directory=chroma_path
-                )
-            
-            # Créer la chaîne RAG avec compression si activée
-            if self.use_compression:
-                base_retriever = self.vector_store.as_retriever(
-                    search_kwargs={"k": self.max_docs_for_context * 2}
-                )
-                compressor = LLMChainExtractor.from_llm(self.llm)
-                retriever = ContextualCompressionRetriever(
-                    base_compressor=compressor,
-                    base_retriever=base_retriever
-                )
-            else:
-                retriever = self.vector_store.as_retriever(
-                    search_kwargs={"k": self.max_docs_for_context}
-                )
-            
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=retriever,
-                return_source_documents=True,
-                verbose=True
-            )
+            self._enrich_metadata(split_docs, original_filename, _file_sha256(pdf_path))
+            vector_store_id = self._index_chunks(split_docs)
             
             processing_time = time.time() - start_time
-            file_size = os.path.getsize(pdf_path)
-            
-            # Enregistrer en base de données
-            db = next(get_db())
-            try:
-                doc_record = DBDocument(
-                    session_id=self.session_id,
-                    filename=f"{uuid.uuid4()}_{original_filename}",
-                    original_name=original_filename,
-                    file_size=file_size,
-                    pages_count=len(documents),
-                    chunks_count=len(split_docs),
-                    processing_time=processing_time,
-                    is_processed=True,
-                    vector_store_id=vector_store_id
-                )
-                
-                db.add(doc_record)
-                
-                # Mettre à jour l'activité de la session
-                session = db.query(ChatSession).filter(ChatSession.id == self.session_id).first()
-                if session:
-                    session.last_activity = datetime.utcnow()
-                
-                db.commit()
-                
-            finally:
-                db.close()
-            
-            # Mettre à jour les statistiques
-            self.processing_stats["documents_processed"] += 1
-            self.processing_stats["total_chunks"] += len(split_docs)
-            self.processing_stats["last_processing_time"] = processing_time
+            self._record_document(pdf_path, original_filename, pages_count,
+                                  len(split_docs), processing_time, vector_store_id)
             
             logger.info("Document processed successfully",
                        filename=original_filename,
@@ -201,7 +396,7 @@ class AdvancedRAGPipeline:
                 "success": True,
                 "filename": original_filename,
                 "chunks_count": len(split_docs),
-                "pages_count": len(documents),
+                "pages_count": pages_count,
                 "processing_time": processing_time,
                 "vector_store_id": vector_store_id
             }
@@ -213,48 +408,256 @@ class AdvancedRAGPipeline:
                         session_id=self.session_id)
             raise
 
+    def process_documents(self, files: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """
+        Traite plusieurs PDFs : chargement et découpage en parallèle dans un pool de processus,
+        puis un seul passage d'embedding pour l'ensemble des chunks.
+        
+        Args:
+            files: Liste de tuples (chemin du PDF, nom de fichier original)
+        """
+        start_time = time.time()
+        
+        logger.info("Starting batch document processing",
+                   files_count=len(files),
+                   session_id=self.session_id)
+        
+        try:
+            # Un même PDF passé plusieurs fois donnerait des identifiants de chunks en double,
+            # refusés en bloc par l'upsert Chroma : seule sa première occurrence est traitée
+            unique_files: Dict[str, Tuple[str, str]] = {}
+            for pdf_path, original_filename in files:
+                unique_files.setdefault(_file_sha256(pdf_path), (pdf_path, original_filename))
+            file_hashes = list(unique_files)
+            files = list(unique_files.values())
+            paths = [pdf_path for pdf_path, _ in files]
+            
+            max_workers = max(1, min(len(files), (os.cpu_count() or 2) - 1))
+            # "spawn" : le thread d'écriture en base et les threads des modèles ne sont pas hérités par fork
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                loaded = list(executor.map(
+                    _load_and_split, paths, repeat(self.chunk_size), repeat(self.chunk_overlap)
+                ))
+            
+            all_docs = []
+            for (_, original_filename), file_hash, (_, split_docs) in zip(files, file_hashes, loaded):
+                self._enrich_metadata(split_docs, original_filename, file_hash)
+                all_docs.extend(split_docs)
+            
+            vector_store_id = self._index_chunks(all_docs)
+            
+            processing_time = time.time() - start_time
+            results = []
+            for (pdf_path, original_filename), (pages_count, split_docs) in zip(files, loaded):
+                self._record_document(pdf_path, original_filename, pages_count,
+                                      len(split_docs), processing_time / len(files), vector_store_id)
+                results.append({
+                    "filename": original_filename,
+                    "chunks_count": len(split_docs),
+                    "pages_count": pages_count
+                })
+            
+            logger.info("Batch document processing completed",
+                       files_count=len(files),
+                       chunks_count=len(all_docs),
+                       processing_time=processing_time,
+                       session_id=self.session_id)
+            
+            return {
+                "success": True,
+                "documents": results,
+                "chunks_count": len(all_docs),
+                "processing_time": processing_time,
+                "vector_store_id": vector_store_id
+            }
+            
+        except Exception as e:
+            logger.error("Batch document processing failed",
+                        files=[name for _, name in files],
+                        error=str(e),
+                        session_id=self.session_id)
+            raise
+
+    def _enrich_metadata(self, split_docs: List[Document], original_filename: str, file_hash: str):
+        """Ajoute les métadonnées de session, de provenance (nom et empreinte du fichier) et de position à chaque chunk."""
+        timestamp = datetime.utcnow().isoformat()
+        for i, doc in enumerate(split_docs):
+            metadata = doc.metadata
+            metadata["session_id"] = self.session_id
+            metadata["source_file"] = original_filename
+            metadata["file_hash"] = file_hash
+            metadata["chunk_index"] = i
+            metadata["processing_timestamp"] = timestamp
+
+    def _index_chunks(self, split_docs: List[Document]) -> str:
+        """Indexe les chunks dans le vector store de la session et reconstruit la chaîne RAG."""
+        vector_store_id = f"session_{self.session_id}"
+        
+        self.vector_store = self._open_vector_store(vector_store_id)
+        self._add_documents_with_embeddings(split_docs)
+        
+        self.qa_chain = self._build_qa_chain()
+        
+        return vector_store_id
+
+    def _open_vector_store(self, vector_store_id: str) -> Chroma:
+        """Ouvre (ou crée) la collection de la session sur le client Chroma partagé."""
+        return Chroma(
+            client=_get_chroma_client(),
+            collection_name=vector_store_id,
+            embedding_function=self.embeddings,
+            collection_metadata=COLLECTION_METADATA
+        )
+
+    def _build_qa_chain(self) -> RetrievalQA:
+        """Construit la chaîne RAG, avec reranking cross-encoder si la compression est activée."""
+        # Le reranker n'est sauté qu'à l'exécution, quand la recherche renvoie au plus max_docs_for_context
+        # documents (petite collection) : la chaîne reste valable quand la collection grandit
+        if self.use_compression:
+            retriever = AdaptiveCompressionRetriever(
+                base_compressor=self._reranker,
+                base_retriever=self.vector_store.as_retriever(
+                    search_kwargs={"k": self.max_docs_for_context * 2}
+                ),
+                threshold=self.max_docs_for_context
+            )
+        else:
+            retriever = self.vector_store.as_retriever(
+                search_kwargs={"k": self.max_docs_for_context}
+            )
+        
+        return RetrievalQA.from_chain_type(
+            llm=self.llm,
+            chain_type="stuff",
+            retriever=retriever,
+            return_source_documents=True
+        )
+
+    @property
+    def _reranker(self) -> CrossEncoderReranker:
+        """Reranker local (singleton de module), construit au premier usage."""
+        return _get_reranker(self.max_docs_for_context)
+
+    def _touch_session(self, db: Session):
+        """
+        Met à jour l'activité de la session avec un UPDATE direct (sans SELECT préalable),
+        au plus une fois par LAST_ACTIVITY_WRITE_INTERVAL secondes.
+        """
+        now = time.time()
+        if now - self._last_activity_write <= LAST_ACTIVITY_WRITE_INTERVAL:
+            return
+        
+        db.execute(
+            update(ChatSession)
+            .where(ChatSession.id == self.session_id)
+            .values(last_activity=datetime.utcnow())
+        )
+        self._last_activity_write = now
+
+    def _record_document(self, pdf_path: str, original_filename: str, pages_count: int,
+                         chunks_count: int, processing_time: float, vector_store_id: str):
+        """Enregistre le document traité en base et met à jour les statistiques."""
+        file_size = os.path.getsize(pdf_path)
+        
+        with _db() as db:
+            doc_record = DBDocument(
+                session_id=self.session_id,
+                filename=f"{uuid.uuid4()}_{original_filename}",
+                original_name=original_filename,
+                file_size=file_size,
+                pages_count=pages_count,
+                chunks_count=chunks_count,
+                processing_time=processing_time,
+                is_processed=True,
+                vector_store_id=vector_store_id
+            )
+            
+            db.add(doc_record)
+            self._touch_session(db)
+            db.commit()
+        
+        # Mettre à jour les statistiques
+        self.processing_stats["documents_processed"] += 1
+        self.processing_stats["total_chunks"] += chunks_count
+        self.processing_stats["last_processing_time"] = processing_time
+
+    async def _aembed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Calcule les embeddings par batchs concurrents, bornés par un sémaphore."""
+        semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+        
+        async def _embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self.embeddings.aembed_documents(batch)
+        
+        batches = await asyncio.gather(*[
+            _embed_batch(texts[i:i + EMBEDDING_BATCH_SIZE])
+            for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+        ])
+        return [vector for batch in batches for vector in batch]
+
+    def _add_documents_with_embeddings(self, split_docs: List[Document]):
+        """Ajoute les chunks au vector store avec des embeddings pré-calculés."""
+        if not split_docs:
+            return
+        
+        # Batchs de longueur homogène : tri par nombre de tokens (chunk_index conserve l'ordre d'origine)
+        encoder = _get_token_encoder()
+        split_docs = sorted(split_docs, key=lambda doc: len(encoder.encode(doc.page_content)))
+        
+        texts = [doc.page_content for doc in split_docs]
+        # Identifiants stables dérivés du contenu du fichier (et non de son nom) : ré-ingérer le même PDF
+        # met à jour ses chunks, deux PDF homonymes ne s'écrasent pas
+        ids = [f"{self.session_id}-{doc.metadata['file_hash']}-{doc.metadata['chunk_index']}"
+               for doc in split_docs]
+        # L'identifiant voyage avec le chunk pour relire son embedding au scoring
+        for doc, chunk_id in zip(split_docs, ids):
+            doc.metadata["chunk_id"] = chunk_id
+        metadatas = [doc.metadata for doc in split_docs]
+        embeddings = run_coroutine(self._aembed_texts(texts))
+        
+        # Chunks d'une ingestion précédente du même fichier (découpage différent) : supprimés,
+        # sinon les indices au-delà du nouveau nombre de chunks resteraient dans la collection
+        for file_hash in {doc.metadata["file_hash"] for doc in split_docs}:
+            self.vector_store._collection.delete(where={"file_hash": file_hash})
+        
+        # Écriture directe (listes parallèles) pour éviter un second passage d'embedding,
+        # découpée selon la taille maximale d'un lot acceptée par Chroma
+        max_batch = _get_chroma_client().get_max_batch_size()
+        for start in range(0, len(ids), max_batch):
+            end = start + max_batch
+            self.vector_store._collection.upsert(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
+        
+        logger.info("Chunks embedded and indexed",
+                   chunks_count=len(texts),
+                   batches=(len(texts) + EMBEDDING_BATCH_SIZE - 1) // EMBEDDING_BATCH_SIZE,
+                   session_id=self.session_id)
+
     def load_session_documents(self, session_id: str = None):
         """Charge tous les documents d'une session existante."""
         target_session = session_id or self.session_id
         
         try:
             vector_store_id = f"session_{target_session}"
-            chroma_path = f"./chroma_db/{vector_store_id}"
+            vector_store = self._open_vector_store(vector_store_id)
             
-            if os.path.exists(chroma_path):
-                self.vector_store = Chroma(
-                    persist_directory=chroma_path,
-                    embedding_function=self.embeddings
-                )
-                
-                # Recréer la chaîne RAG
-                if self.use_compression:
-                    base_retriever = self.vector_store.as_retriever(
-                        search_kwargs={"k": self.max_docs_for_context * 2}
-                    )
-                    compressor = LLMChainExtractor.from_llm(self.llm)
-                    retriever = ContextualCompressionRetriever(
-                        base_compressor=compressor,
-                        base_retriever=base_retriever
-                    )
-                else:
-                    retriever = self.vector_store.as_retriever(
-                        search_kwargs={"k": self.max_docs_for_context}
-                    )
-                
-                self.qa_chain = RetrievalQA.from_chain_type(
-                    llm=self.llm,
-                    chain_type="stuff",
-                    retriever=retriever,
-                    return_source_documents=True
-                )
-                
-                logger.info("Session documents loaded", session_id=target_session)
-                return True
-            else:
+            if vector_store._collection.count() == 0:
                 logger.warning("No vector store found for session", session_id=target_session)
                 return False
-                
+            
+            self.vector_store = vector_store
+            
+            # Recréer la chaîne RAG
+            self.qa_chain = self._build_qa_chain()
+            
+            logger.info("Session documents loaded", session_id=target_session)
+            return True
+            
         except Exception as e:
             logger.error("Failed to load session documents", 
                         session_id=target_session, 
@@ -275,53 +678,34 @@ class AdvancedRAGPipeline:
                    session_id=self.session_id)
         
         try:
-            result = self.qa_chain.invoke({"query": question})
+            cache_stats = {"lookups": 0, "hits": 0}
+            stats_token = _LLM_CACHE_STATS.set(cache_stats)
+            try:
+                with get_openai_callback() as cb:
+                    result = self.qa_chain.invoke({"query": question})
+            finally:
+                _LLM_CACHE_STATS.reset(stats_token)
             response_time = time.time() - start_time
             
+            # Succès signalé par le cache lui-même ; tokens_used reste le nombre de tokens facturés
+            tokens_used = cb.total_tokens
+            cache_hit = cache_stats["lookups"] > 0 and cache_stats["hits"] == cache_stats["lookups"]
+            
             # Calculer un score de confiance basique
-            confidence_score = self._calculate_confidence_score(result)
-            
-            # Structurer les sources
-            sources = []
-            if result.get("source_documents"):
-                for doc in result["source_documents"]:
-                    sources.append({
-                        "content": doc.page_content,
-                        "metadata": doc.metadata,
-                        "source_file": doc.metadata.get("source_file", "Unknown")
-                    })
+            confidence_score = self._calculate_confidence_score(question, result.get("source_documents"))
+            
+            sources = self._format_sources(result.get("source_documents"))
             
             # Sauvegarder la conversation si demandé
             if save_conversation:
-                db = next(get_db())
-                try:
-                    conversation = Conversation(
-                        session_id=self.session_id,
-                        question=question,
-                        answer=result["result"],
-                        sources_count=len(sources),
-                        response_time=response_time,
-                        confidence_score=confidence_score,
-                        model_used="gpt-3.5-turbo",
-                        retrieval_method="similarity_with_compression" if self.use_compression else "similarity"
-                    )
-                    
-                    db.add(conversation)
-                    
-                    # Mettre à jour l'activité de la session
-                    session = db.query(ChatSession).filter(ChatSession.id == self.session_id).first()
-                    if session:
-                        session.last_activity = datetime.utcnow()
-                    
-                    db.commit()
-                    
-                finally:
-                    db.close()
+                self._save_conversation(question, result["result"], len(sources),
+                                        response_time, confidence_score, tokens_used, cache_hit)
             
             logger.info("Question processed successfully",
                        response_time=response_time,
                        sources_count=len(sources),
                        confidence_score=confidence_score,
+                       cache_hit=cache_hit,
                        session_id=self.session_id)
             
             return {
@@ -329,6 +713,7 @@ class AdvancedRAGPipeline:
                 "sources": sources,
                 "response_time": response_time,
                 "confidence_score": confidence_score,
+                "cache_hit": cache_hit,
                 "session_id": self.session_id
             }
             
@@ -339,44 +724,130 @@ class AdvancedRAGPipeline:
                         session_id=self.session_id)
             raise
 
-    def _calculate_confidence_score(self, result: Dict) -> float:
-        """Calcule un score de confiance basique pour la réponse."""
+    async def astream_question(self, question: str,
+                               save_conversation: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Pose une question en streaming : les tokens sont émis dès leur génération.
+        
+        Yields:
+            {"type": "token", "content": ...} pour chaque token, puis
+            {"type": "sources", "sources": [...]} une fois la génération terminée
+        """
+        if not self.qa_chain:
+            raise ValueError("No documents loaded. Please process documents first.")
+        
+        start_time = time.time()
+        answer_parts = []
+        source_documents = []
+        
+        logger.info("Streaming question", 
+                   question=question[:100] + "..." if len(question) > 100 else question,
+                   session_id=self.session_id)
+        
+        try:
+            async for event in self.qa_chain.astream_events({"query": question}, version="v2"):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    token = event["data"]["chunk"].content
+                    if token:
+                        answer_parts.append(token)
+                        yield {"type": "token", "content": token}
+                elif kind == "on_retriever_end":
+                    # Le dernier retriever terminé est le plus externe (après reranking)
+                    source_documents = event["data"].get("output") or []
+            
+            yield {"type": "sources", "sources": self._format_sources(source_documents)}
+            
+        finally:
+            # Enregistrer la conversation une fois le flux terminé (ou interrompu)
+            answer = "".join(answer_parts)
+            if save_conversation and answer:
+                # Embedding de la question + lecture Chroma bloquants : hors de la boucle d'événements
+                confidence_score = await asyncio.to_thread(
+                    self._calculate_confidence_score, question, source_documents
+                )
+                self._save_conversation(question, answer, len(source_documents),
+                                        time.time() - start_time, confidence_score)
+
+    def _format_sources(self, source_documents: Optional[List[Document]]) -> List[Dict[str, Any]]:
+        """Structure les documents sources pour la réponse API."""
+        return [
+            {
+                "content": doc.page_content,
+                "metadata": doc.metadata,
+                "source_file": doc.metadata.get("source_file", "Unknown")
+            }
+            for doc in source_documents or []
+        ]
+
+    def _save_conversation(self, question: str, answer: str, sources_count: int,
+                           response_time: float, confidence_score: float,
+                           tokens_used: Optional[int] = None, cache_hit: Optional[bool] = None):
+        """Enregistre un échange question/réponse en base, hors du chemin critique de la requête."""
+        _enqueue_db_write({
+            "session_id": self.session_id,
+            "question": question,
+            "answer": answer,
+            "sources_count": sources_count,
+            "response_time": response_time,
+            "confidence_score": confidence_score,
+            "tokens_used": tokens_used,
+            "cache_hit": cache_hit,
+            "model_used": "gpt-3.5-turbo",
+            "retrieval_method": "similarity_with_rerank" if self.use_compression else "similarity"
+        })
+
+    def _calculate_confidence_score(self, question: str, source_documents: List[Document]) -> float:
+        """
+        Score de confiance : similarité cosinus moyenne entre la question
+        et les chunks récupérés, calculée sur les embeddings déjà stockés.
+        """
         try:
-            # Facteurs simples pour estimer la confiance
-            source_count = len(result.get("source_documents", []))
-            answer_length = len(result.get("result", ""))
-            
-            # Score basé sur la disponibilité des sources et longueur de réponse
-            if source_count == 0:
-                return 0.1
-            elif source_count >= 3 and answer_length > 100:
-                return 0.9
-            elif source_count >= 2 and answer_length > 50:
-                return 0.7
-            else:
-                return 0.5
+            ids = [doc.metadata.get("chunk_id") or getattr(doc, "id", None)
+                   for doc in source_documents or []]
+            ids = [chunk_id for chunk_id in ids if chunk_id]
+            if not ids:
+                return 0.0
+            
+            stored = self.vector_store._collection.get(ids=ids, include=["embeddings"])["embeddings"]
+            if stored is None or len(stored) == 0:
+                return 0.0
+            
+            q = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+            D = np.asarray(stored, dtype=np.float32)
+            q = q / np.linalg.norm(q)
+            D = D / np.linalg.norm(D, axis=-1, keepdims=True)
+            
+            score = float(np.mean(np.einsum("d,nd->n", q, D)))
+            return max(0.0, min(1.0, score))
                 
-        except Exception:
-            return 0.5
+        except Exception as e:
+            logger.warning("Confidence score computation failed", error=str(e))
+            return 0.0
 
     def get_session_summary(self) -> Dict[str, Any]:
         """Retourne un résumé de la session courante."""
-        db = next(get_db())
-        try:
+        with _db() as db:
             session = db.query(ChatSession).filter(ChatSession.id == self.session_id).first()
-            documents = db.query(DBDocument).filter(DBDocument.session_id == self.session_id).all()
-            conversations = db.query(Conversation).filter(Conversation.session_id == self.session_id).all()
+            
+            # Agrégations calculées côté SQL : seuls des scalaires transitent
+            documents_count, total_chunks = db.query(
+                func.count(DBDocument.id),
+                func.sum(DBDocument.chunks_count)
+            ).filter(DBDocument.session_id == self.session_id).one()
+            
+            conversations_count, avg_response_time = db.query(
+                func.count(Conversation.id),
+                func.avg(Conversation.response_time)
+            ).filter(Conversation.session_id == self.session_id).one()
             
             return {
                 "session_id": self.session_id,
                 "session_name": session.name if session else "Unknown",
                 "created_at": session.created_at.isoformat() if session else None,
-                "documents_count": len(documents),
-                "conversations_count": len(conversations),
-                "total_chunks": sum(doc.chunks_count for doc in documents if doc.chunks_count),
+                "documents_count": documents_count,
+                "conversations_count": conversations_count,
+                "total_chunks": total_chunks or 0,
                 "processing_stats": self.processing_stats,
-                "avg_response_time": sum(conv.response_time for conv in conversations if conv.response_time) / len(conversations) if conversations else 0
+                "avg_response_time": float(avg_response_time or 0)
             }
-            
-        finally:
-            db.close()
@@ -3,12 +3,15 @@ Système d'agents IA autonomes avec capacité d'utiliser des outils.
 Utilise le pattern ReAct (Reasoning + Acting) de LangChain.
 """
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Tuple
+from functools import lru_cache
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_openai import ChatOpenAI
 from langchain.tools import Tool
+from langchain.tools.render import render_text_description
 from langchain.prompts import PromptTemplate
 import structlog
+import asyncio
 import time
 
 from app.core.tools import (
@@ -21,6 +24,55 @@ from app.core.tools import (
 
 logger = structlog.get_logger(__name__)
 
+# Taille maximale d'une observation renvoyée à l'agent (elle est réinjectée dans le scratchpad)
+TOOL_OBSERVATION_MAX_CHARS = 1200
+
+
+def _cap(func: Callable[[str], Any], max_chars: int = TOOL_OBSERVATION_MAX_CHARS) -> Callable[[str], str]:
+    """Tronque la sortie d'un outil avant qu'elle n'entre dans le prompt."""
+    def capped(tool_input: str) -> str:
+        return str(func(tool_input))[:max_chars]
+    return capped
+
+
+def _acap(coroutine: Optional[Callable[[str], Awaitable[Any]]],
+          max_chars: int = TOOL_OBSERVATION_MAX_CHARS) -> Optional[Callable[[str], Awaitable[str]]]:
+    """Version asynchrone de _cap (None si l'outil n'a pas de variante async)."""
+    if coroutine is None:
+        return None
+    
+    async def capped(tool_input: str) -> str:
+        return str(await coroutine(tool_input))[:max_chars]
+    return capped
+
+
+@lru_cache(maxsize=1)
+def _shared_tools() -> Tuple[Tool, ...]:
+    """Outils indépendants de la session, construits une seule fois et partagés par tous les agents."""
+    tools = [
+        _as_tool(CalculatorTool()),
+        _as_tool(DateTimeTool()),
+        _as_tool(TextAnalysisTool()),
+    ]
+    
+    # Outil Web Search (avec gestion d'erreur améliorée)
+    try:
+        tools.append(_as_tool(WebSearchTool()))
+    except Exception as e:
+        logger.warning("Web search tool not available", error=str(e))
+    
+    return tuple(tools)
+
+
+def _as_tool(tool_obj) -> Tool:
+    """Expose un outil maison à LangChain, avec observations tronquées."""
+    return Tool(
+        name=tool_obj.name,
+        func=_cap(tool_obj.run),
+        coroutine=_acap(getattr(tool_obj, "arun", None)),
+        description=tool_obj.description
+    )
+
 # Template de prompt pour l'agent ReAct
 REACT_PROMPT_TEMPLATE = """Tu es un assistant IA intelligent qui peut utiliser des outils pour répondre aux questions.
 
@@ -74,10 +126,14 @@ class RAGAgent:
         # Initialiser les outils
         self.tools = self._setup_tools()
         
-        # Créer le prompt
+        # Créer le prompt : la liste des outils est figée pour la durée de vie de l'agent,
+        # seuls {input} et {agent_scratchpad} restent à substituer à chaque appel
         self.prompt = PromptTemplate(
-            input_variables=["input", "agent_scratchpad", "tools", "tool_names"],
+            input_variables=["input", "agent_scratchpad"],
             template=REACT_PROMPT_TEMPLATE
+        ).partial(
+            tools=render_text_description(self.tools),
+            tool_names=", ".join(tool.name for tool in self.tools)
         )
         
         # Créer l'agent et l'executor
@@ -92,6 +148,7 @@ class RAGAgent:
             tools=self.tools,
             verbose=True,
             max_iterations=5,
+            max_execution_time=15,
             handle_parsing_errors=True,
             return_intermediate_steps=True
         )
@@ -102,52 +159,13 @@ class RAGAgent:
     
     def _setup_tools(self) -> List[Tool]:
         """Configure tous les outils disponibles pour l'agent."""
-        tools = []
-        
-        # Outil Calculator
-        calc_tool = CalculatorTool()
-        tools.append(Tool(
-            name=calc_tool.name,
-            func=calc_tool.run,
-            description=calc_tool.description
-        ))
-        
-        # Outil DateTime
-        datetime_tool = DateTimeTool()
-        tools.append(Tool(
-            name=datetime_tool.name,
-            func=datetime_tool.run,
-            description=datetime_tool.description
-        ))
-        
-        # Outil Text Analysis
-        text_tool = TextAnalysisTool()
-        tools.append(Tool(
-            name=text_tool.name,
-            func=text_tool.run,
-            description=text_tool.description
-        ))
-        
-        # Outil Web Search (avec gestion d'erreur améliorée)
-        try:
-            search_tool = WebSearchTool()
-            tools.append(Tool(
-                name=search_tool.name,
-                func=search_tool.run,
-                description=search_tool.description
-            ))
-        except Exception as e:
-            logger.warning("Web search tool not available", error=str(e))
+        tools = list(_shared_tools())
         
         # Outil Document Query (si RAG pipeline disponible)
         if self.rag_pipeline:
             try:
                 doc_tool = DocumentQueryTool(self.rag_pipeline)
-                tools.append(Tool(
-                    name=doc_tool.name,
-                    func=doc_tool.run,
-                    description=doc_tool.description
-                ))
+                tools.append(_as_tool(doc_tool))
             except Exception as e:
                 logger.warning("Document query tool not available", error=str(e))
         
@@ -155,7 +173,21 @@ class RAGAgent:
     
     def run(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
-        Exécute l'agent sur une question.
+        Exécute l'agent sur une question (version synchrone de arun).
+        
+        Args:
+            question: La question à traiter
+            session_id: ID de session (optionnel)
+            
+        Returns:
+            Dictionnaire avec la réponse et les étapes intermédiaires
+        """
+        return asyncio.run(self.arun(question, session_id))
+    
+    async def arun(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Exécute l'agent de façon asynchrone : les appels LLM et les outils I/O
+        ne bloquent pas la boucle d'événements du serveur.
         
         Args:
             question: La question à traiter
@@ -172,7 +204,7 @@ class RAGAgent:
         
         try:
             # Exécuter l'agent
-            result = self.agent_executor.invoke({"input": question})
+            result = await self.agent_executor.ainvoke({"input": question})
             
             response_time = time.time() - start_time
             
@@ -240,10 +272,14 @@ class SimpleAgent:
     
     def run(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Exécute l'agent simple."""
+        return asyncio.run(self.arun(question, session_id))
+    
+    async def arun(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Exécute l'agent simple de façon asynchrone."""
         start_time = time.time()
         
         try:
-            response = self.llm.invoke(question)
+            response = await self.llm.ainvoke(question)
             
             return {
                 "answer": response.content,
@@ -0,0 +1,18 @@
+"""
+Utilitaires pour appeler du code asynchrone depuis du code synchrone.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_coroutine(coro):
+    """Exécute une coroutine depuis du code synchrone, même si une boucle asyncio tourne déjà."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    
+    # Appel depuis un endpoint async : exécuter dans un thread dédié avec sa propre boucle
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
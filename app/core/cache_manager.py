@@ -6,45 +6,110 @@ Utilise diskcache pour la persistance locale gratuite.
 from typing import Any, Optional, Callable
 import hashlib
 import json
+import numpy as np
+import base64
+import zstandard as zstd
 from diskcache import Cache
 import structlog
 from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import random
+import asyncio
+import threading
 import time
 
 logger = structlog.get_logger(__name__)
 
+# Cache d'embeddings sans éviction, purge ni expiration : un embedding dépend uniquement
+# de (texte, modèle), il n'y a rien à invalider. Attention, diskcache ignore alors size_limit.
+# Les autres caches (réponses, documents, juge) gardent la politique par défaut
+# (least-recently-stored) : leur size_limit est respecté et les entrées expirées
+# sont purgées au fil des écritures.
+EMBEDDING_CACHE_SETTINGS = {"eviction_policy": "none", "cull_limit": 0}
+
+# Niveau zstd des sources compressées (bon compromis ratio/débit sur du texte)
+ZSTD_LEVEL = 3
+# Taille (octets UTF-8) en dessous de laquelle une source reste en clair : zstd + base64 l'agrandirait
+ZSTD_MIN_SOURCE_SIZE = 1024
+
+# Longueur en dessous de laquelle un texte sert directement de clé d'embedding
+RAW_KEY_MAX_LENGTH = 64
+
 # Cache global
-embedding_cache = Cache('./cache/embeddings', size_limit=2**30)  # 1GB
+embedding_cache = Cache('./cache/embeddings', **EMBEDDING_CACHE_SETTINGS)
 response_cache = Cache('./cache/responses', size_limit=2**30)    # 1GB
+judge_cache = Cache('./cache/judge', size_limit=2**28)            # 256MB, scores du juge LLM
 
 class CacheManager:
     """Gestionnaire de cache intelligent."""
     
-    def __init__(self, cache_dir: str = './cache', ttl: int = 86400):
+    def __init__(self, cache_dir: str = './cache', ttl: int = 86400,
+                 embedding_size_limit: int = 2**30,
+                 response_size_limit: int = 2**30,
+                 document_size_limit: int = 5 * 2**30,
+                 l1_max_size: int = 1024):
         """
         Initialise le gestionnaire de cache.
         
         Args:
             cache_dir: Dossier de cache
             ttl: Time to live en secondes (défaut: 24h)
+            embedding_size_limit: Taille indicative du cache d'embeddings en octets (défaut: 1GB) ;
+                                  non appliquée, ce cache n'évince pas (voir EMBEDDING_CACHE_SETTINGS)
+            response_size_limit: Taille max du cache de réponses en octets (défaut: 1GB)
+            document_size_limit: Taille max du cache de documents en octets (défaut: 5GB)
+            l1_max_size: Nombre max d'embeddings gardés en mémoire devant le cache disque
         """
         self.cache_dir = cache_dir
         self.ttl = ttl
         
         # Créer les caches spécialisés
-        self.embedding_cache = Cache(f'{cache_dir}/embeddings', size_limit=2**30)
-        self.response_cache = Cache(f'{cache_dir}/responses', size_limit=2**30)
-        self.document_cache = Cache(f'{cache_dir}/documents', size_limit=5**30)  # 5GB
+        self.embedding_cache = Cache(f'{cache_dir}/embeddings', size_limit=embedding_size_limit, **EMBEDDING_CACHE_SETTINGS)
+        # Les réponses gardent leur TTL (les documents de la session peuvent changer)
+        self.response_cache = Cache(f'{cache_dir}/responses', size_limit=response_size_limit)
+        self.document_cache = Cache(f'{cache_dir}/documents', size_limit=document_size_limit)
+        
+        # Niveau L1 en mémoire devant le cache disque des embeddings (LRU)
+        self._l1 = OrderedDict()
+        self._l1_max_size = l1_max_size
+        self._l1_lock = threading.Lock()
         
         logger.info("Cache manager initialized", cache_dir=cache_dir, ttl=ttl)
 
+    def _l1_get(self, key: str) -> Optional[Any]:
+        """Lit une entrée du cache mémoire et la marque comme récemment utilisée."""
+        with self._l1_lock:
+            value = self._l1.get(key)
+            if value is not None:
+                self._l1.move_to_end(key)
+            return value
+
+    def _l1_put(self, key: str, value: Any):
+        """Insère une entrée dans le cache mémoire en évinçant la plus ancienne si besoin."""
+        with self._l1_lock:
+            self._l1[key] = value
+            self._l1.move_to_end(key)
+            if len(self._l1) > self._l1_max_size:
+                self._l1.popitem(last=False)
+
     def _generate_key(self, *args, **kwargs) -> str:
-        """Génère une clé de cache unique."""
-        # Combiner tous les arguments dans une chaîne
-        key_data = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True)
+        """
+        Génère une clé de cache unique (128 bits, hexadécimal).
+        SHA-256 passe par OpenSSL, qui utilise les instructions SHA-NI / ARMv8-CE quand le CPU les a.
+        """
+        hasher = hashlib.sha256()
+        
+        if not kwargs and all(isinstance(arg, str) for arg in args):
+            # Chemin rapide (texte, modèle...) : octets bruts préfixés par leur longueur, sans JSON
+            for arg in args:
+                data = arg.encode('utf-8')
+                hasher.update(len(data).to_bytes(8, 'little'))
+                hasher.update(data)
+        else:
+            hasher.update(json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True).encode())
         
-        # Hasher pour créer une clé courte
-        return hashlib.md5(key_data.encode()).hexdigest()
+        return hasher.hexdigest()[:32]
 
     def cache_embedding(self, text: str, model: str = "text-embedding-ada-002"):
         """
@@ -58,19 +123,31 @@ class CacheManager:
         def decorator(func: Callable):
             @wraps(func)
             def wrapper(text: str, model: str = model):
-                # Générer la clé de cache
-                cache_key = self._generate_key(text, model)
+                # Générer la clé de cache (texte court : utilisé tel quel, sans hachage)
+                if len(text) <= RAW_KEY_MAX_LENGTH:
+                    cache_key = f"{model}:{text}"
+                else:
+                    cache_key = self._generate_key(text, model)
+                
+                # Chercher en mémoire (L1), puis sur disque (L2)
+                cached = self._l1_get(cache_key)
+                if cached is not None:
+                    return cached
                 
-                # Chercher dans le cache
                 cached = self.embedding_cache.get(cache_key)
                 if cached is not None:
                     logger.debug("Embedding cache hit", key=cache_key[:8])
+                    if isinstance(cached, bytes):
+                        cached = np.frombuffer(cached, dtype=np.float32).tolist()
+                    self._l1_put(cache_key, cached)
                     return cached
                 
-                # Calculer et cacher
+                # Calculer et cacher (float32 brut : ~6KB par vecteur 1536d au lieu d'une liste picklée).
+                # Pas d'expiration : la clé désigne (texte, modèle), la valeur ne peut pas devenir fausse
                 logger.debug("Embedding cache miss", key=cache_key[:8])
                 result = func(text, model)
-                self.embedding_cache.set(cache_key, result, expire=self.ttl)
+                self.embedding_cache.set(cache_key, np.asarray(result, dtype=np.float32).tobytes())
+                self._l1_put(cache_key, result)
                 
                 return result
             
@@ -146,7 +223,12 @@ class CacheManager:
             logger.info("Documents cache cleared")
 
     def optimize_cache(self):
-        """Optimise le cache en supprimant les entrées expirées."""
+        """
+        Optimise le cache en supprimant les entrées expirées.
+        
+        Les caches de réponses et de documents se purgent déjà au fil des écritures ;
+        les embeddings sont écrits sans expiration, seules d'anciennes entrées datées sont concernées.
+        """
         self.embedding_cache.expire()
         self.response_cache.expire()
         self.document_cache.expire()
@@ -157,96 +239,217 @@ class CacheManager:
 class BatchProcessor:
     """Processeur batch pour traiter plusieurs documents/requêtes efficacement."""
     
-    def __init__(self, batch_size: int = 10):
+    def __init__(self, batch_size: int = 64, max_concurrent_batches: int = 4):
         """
         Initialise le processeur batch.
         
         Args:
-            batch_size: Taille des batchs
+            batch_size: Taille des batchs (OpenAI accepte jusqu'à 2048 textes par appel)
+            max_concurrent_batches: Nombre de batchs envoyés simultanément
         """
         self.batch_size = batch_size
-        logger.info("Batch processor initialized", batch_size=batch_size)
+        self.max_concurrent_batches = max_concurrent_batches
+        logger.info("Batch processor initialized",
+                   batch_size=batch_size,
+                   max_concurrent_batches=max_concurrent_batches)
+
+    def _embed_batch(self, batch: list, embedding_func: Callable) -> list:
+        """Embedde un batch en un appel, avec repli unitaire si la réponse est incomplète."""
+        # Léger décalage aléatoire, dans le worker : les premiers appels ne partent pas en rafale (429)
+        # et la soumission des batchs suivants n'attend pas
+        time.sleep(random.uniform(0, 0.05))
+        batch_embeddings = embedding_func(batch)
+        
+        if batch_embeddings is None or len(batch_embeddings) != len(batch):
+            logger.warning("Bulk embedding returned unexpected size, falling back to per-item calls",
+                           expected=len(batch),
+                           received=len(batch_embeddings) if batch_embeddings is not None else 0)
+            batch_embeddings = [embedding_func([text])[0] for text in batch]
+        
+        return batch_embeddings
 
     def batch_embed_texts(self, texts: list, embedding_func: Callable) -> list:
         """
-        Traite les embeddings par batch pour optimiser les appels API.
+        Traite les embeddings par batch : un appel API par batch, plusieurs batchs en vol.
         
         Args:
             texts: Liste de textes à embedder
-            embedding_func: Fonction d'embedding
+            embedding_func: Fonction d'embedding en masse (List[str] -> List[List[float]]),
+                            par exemple OpenAIEmbeddings.embed_documents
             
         Returns:
-            Liste d'embeddings
+            Liste d'embeddings, dans l'ordre des textes
         """
-        embeddings = []
+        # Liste pré-allouée : chaque batch est écrit à sa place, dans l'ordre où il se termine
+        embeddings = [None] * len(texts)
         
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            
-            logger.debug("Processing embedding batch",
-                        batch_num=i//self.batch_size + 1,
-                        batch_size=len(batch))
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_batches) as executor:
+            futures = {}
+            for i in range(0, len(texts), self.batch_size):
+                batch = texts[i:i + self.batch_size]
+                
+                logger.debug("Submitting embedding batch",
+                            batch_num=i//self.batch_size + 1,
+                            batch_size=len(batch))
+                futures[executor.submit(self._embed_batch, batch, embedding_func)] = i
             
-            # Traiter le batch
-            batch_embeddings = [embedding_func(text) for text in batch]
-            embeddings.extend(batch_embeddings)
+            for future in as_completed(futures):
+                i = futures[future]
+                batch_embeddings = future.result()
+                embeddings[i:i + len(batch_embeddings)] = batch_embeddings
         
         return embeddings
 
+    async def abatch_embed_texts(self, texts: list, aembedding_func: Callable) -> list:
+        """
+        Version asynchrone de batch_embed_texts, sans thread : les batchs sont
+        envoyés en parallèle sur la boucle d'événements, bornés par un sémaphore.
+        
+        Args:
+            texts: Liste de textes à embedder
+            aembedding_func: Coroutine d'embedding en masse, par exemple OpenAIEmbeddings.aembed_documents
+            
+        Returns:
+            Liste d'embeddings, dans l'ordre des textes
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+        
+        async def embed_batch(batch: list) -> list:
+            async with semaphore:
+                batch_embeddings = await aembedding_func(batch)
+                
+                if batch_embeddings is None or len(batch_embeddings) != len(batch):
+                    logger.warning("Bulk embedding returned unexpected size, falling back to per-item calls",
+                                   expected=len(batch),
+                                   received=len(batch_embeddings) if batch_embeddings is not None else 0)
+                    batch_embeddings = [(await aembedding_func([text]))[0] for text in batch]
+                
+                return batch_embeddings
+        
+        batches = await asyncio.gather(*[
+            embed_batch(texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ])
+        return [embedding for batch in batches for embedding in batch]
+
     def batch_process_documents(self, documents: list, process_func: Callable) -> list:
         """
-        Traite plusieurs documents en parallèle (simulation).
+        Traite plusieurs documents en parallèle, par batchs.
         
         Args:
             documents: Liste de documents
             process_func: Fonction de traitement
             
         Returns:
-            Résultats du traitement
+            Résultats du traitement, dans l'ordre des documents
         """
-        results = []
+        results = [None] * len(documents)
         
-        for i in range(0, len(documents), self.batch_size):
-            batch = documents[i:i + self.batch_size]
-            
-            # Traiter séquentiellement (en production, utiliser ThreadPoolExecutor)
-            batch_results = [process_func(doc) for doc in batch]
-            results.extend(batch_results)
+        def process_batch(batch: list) -> list:
+            return [process_func(doc) for doc in batch]
+        
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_batches) as executor:
+            futures = {
+                executor.submit(process_batch, documents[i:i + self.batch_size]): i
+                for i in range(0, len(documents), self.batch_size)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                batch_results = future.result()
+                results[i:i + len(batch_results)] = batch_results
         
         return results
 
 
+def _content_hash(obj: Any) -> bytes:
+    """Empreinte (128 bits) du contenu d'une structure JSON-sérialisable."""
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).digest()[:16]
+
+
 class CompressionManager:
     """Gestionnaire de compression pour optimiser le stockage et le transfert."""
     
-    @staticmethod
-    def compress_response(response: dict) -> dict:
+    # Résultats mémoïsés par empreinte de contenu (les réponses identiques sont fréquentes en chat).
+    # Les objets renvoyés sont partagés : ne pas les modifier.
+    MEMO_MAX_SIZE = 256
+    MEMO_MIN_SOURCES = 3  # en dessous, hacher coûte plus cher que compresser
+    _memo = OrderedDict()
+    _memo_lock = threading.Lock()
+    
+    @classmethod
+    def _memoized(cls, key: bytes, compute: Callable[[], Any]) -> Any:
+        with cls._memo_lock:
+            if key in cls._memo:
+                cls._memo.move_to_end(key)
+                return cls._memo[key]
+        
+        value = compute()
+        with cls._memo_lock:
+            cls._memo[key] = value
+            if len(cls._memo) > cls.MEMO_MAX_SIZE:
+                cls._memo.popitem(last=False)
+        return value
+    
+    @classmethod
+    def compress_response(cls, response: dict, pack_sources: bool = False) -> dict:
         """
         Compresse une réponse en supprimant les informations redondantes.
         
         Args:
             response: Réponse complète
+            pack_sources: Compresser (zstd + base64) les sources volumineuses, pour le stockage
+                          ou un client qui appelle decompress_source. Par défaut, les sources
+                          restent en clair dans "content" (réponses d'API).
             
         Returns:
             Réponse compressée
         """
-        compressed = response.copy()
+        if len(response.get("sources") or []) > cls.MEMO_MIN_SOURCES:
+            return cls._memoized(b"response%d" % pack_sources + _content_hash(response),
+                                 lambda: cls._compress_response(response, pack_sources))
+        return cls._compress_response(response, pack_sources)
+
+    @staticmethod
+    def _compress_response(response: dict, pack_sources: bool = False) -> dict:
+        sources = response.get("sources")
+        if not sources:
+            return response.copy()
+        
+        # Dictionnaire de sortie construit directement, sans copier puis écraser les sources
+        compressed = {k: v for k, v in response.items() if k != "sources"}
         
-        # Réduire la taille des sources
-        if "sources" in compressed and compressed["sources"]:
-            compressed["sources"] = [
-                {
-                    "content": src["content"][:500] + "..." if len(src["content"]) > 500 else src["content"],
-                    "metadata": {k: v for k, v in src.get("metadata", {}).items() if k in ["source_file", "page"]}
-                }
-                for src in compressed["sources"][:3]  # Limiter à 3 sources
-            ]
+        compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL) if pack_sources else None
+        packed_sources = []
+        for src in sources[:3]:  # Limiter à 3 sources
+            packed = {"metadata": {k: v for k, v in src.get("metadata", {}).items() if k in ["source_file", "page"]}}
+            data = src["content"].encode("utf-8")
+            if compressor is not None and len(data) >= ZSTD_MIN_SOURCE_SIZE:
+                # Clé distincte : un lecteur de "content" ne reçoit jamais de texte opaque
+                packed["content_zstd"] = base64.b64encode(compressor.compress(data)).decode("ascii")
+            else:
+                packed["content"] = src["content"]
+            packed_sources.append(packed)
+        compressed["sources"] = packed_sources
         
         return compressed
 
     @staticmethod
-    def compress_reasoning_steps(steps: list) -> list:
+    def decompress_source(source: dict) -> str:
+        """Retourne le contenu en clair d'une source, compressée ou non."""
+        if "content_zstd" not in source:
+            return source["content"]
+        return zstd.ZstdDecompressor().decompress(base64.b64decode(source["content_zstd"])).decode("utf-8")
+
+    @classmethod
+    def compress_reasoning_steps(cls, steps: list) -> list:
         """Compresse les étapes de raisonnement de l'agent."""
+        if len(steps) > cls.MEMO_MIN_SOURCES:
+            return cls._memoized(b"steps" + _content_hash(steps),
+                                 lambda: cls._compress_reasoning_steps(steps))
+        return cls._compress_reasoning_steps(steps)
+
+    @staticmethod
+    def _compress_reasoning_steps(steps: list) -> list:
         return [
             {
                 "tool": step["tool"],
@@ -259,6 +462,6 @@ class CompressionManager:
 
 # Instances globales
 cache_manager = CacheManager()
-batch_processor = BatchProcessor(batch_size=10)
+batch_processor = BatchProcessor(batch_size=64)
 compression_manager = CompressionManager()
 
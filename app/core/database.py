@@ -2,30 +2,79 @@
 Gestion de la base de données pour les sessions et métadonnées des documents.
 """
 
-from sqlalchemy import create_engine, Column, String, DateTime, Text, Integer, Float, Boolean, ForeignKey
+from sqlalchemy import event, func, insert, inspect, select, create_engine, Index, Column, String, DateTime, Text, Integer, Float, Boolean, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.dialects.postgresql import UUID
+from typing import List
 import uuid
+import time
 from datetime import datetime
 import os
 
 # Configuration de la base de données
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./rag_sessions.db")
 
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+if "sqlite" in DATABASE_URL:
+    # QueuePool explicite : les connexions (et leurs PRAGMA) sont réutilisées d'une requête à l'autre
+    engine = create_engine(
+        DATABASE_URL, 
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True
+    )
+    
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL (lectures concurrentes pendant les écritures), cache de 64MB et lectures via mmap."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.close()
+else:
+    # Pool de connexions dimensionné pour le trafic concurrent des agents (PostgreSQL)
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=20,
+        max_overflow=40,
+        pool_recycle=1800,
+        pool_pre_ping=True
+    )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False : pas de re-SELECT lors de la lecture des attributs après un commit
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
+def _uuid7() -> uuid.UUID:
+    """UUID version 7 (RFC 9562) : 48 bits de timestamp en ms suivis de bits aléatoires."""
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (timestamp_ms & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76                          # version
+    value |= ((rand >> 62) & 0xFFF) << 64       # rand_a (12 bits)
+    value |= 0b10 << 62                         # variante RFC
+    value |= rand & ((1 << 62) - 1)             # rand_b (62 bits)
+    return uuid.UUID(int=value)
+
+def new_id() -> str:
+    """
+    Identifiant de clé primaire ordonné dans le temps : les insertions s'ajoutent
+    en fin d'index B-tree au lieu de toucher une page aléatoire (cas de uuid4).
+    """
+    return str(getattr(uuid, "uuid7", _uuid7)())
+
 class ChatSession(Base):
     """Modèle pour une session de chat utilisateur."""
     __tablename__ = "chat_sessions"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=new_id)
     name = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_activity = Column(DateTime, default=datetime.utcnow)
@@ -39,8 +88,8 @@ class Document(Base):
     """Modèle pour un document traité."""
     __tablename__ = "documents"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False)
+    id = Column(String, primary_key=True, default=new_id)
+    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False, index=True)
     filename = Column(String, nullable=False)
     original_name = Column(String, nullable=False)
     file_size = Column(Integer, nullable=False)
@@ -48,7 +97,7 @@ class Document(Base):
     chunks_count = Column(Integer)
     processing_time = Column(Float)  # en secondes
     upload_time = Column(DateTime, default=datetime.utcnow)
-    is_processed = Column(Boolean, default=False)
+    is_processed = Column(Boolean, default=False, index=True)
     vector_store_id = Column(String)  # ID dans ChromaDB
     
     # Relations
@@ -58,29 +107,33 @@ class Conversation(Base):
     """Modèle pour stocker l'historique des conversations."""
     __tablename__ = "conversations"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False)
+    id = Column(String, primary_key=True, default=new_id)
+    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False, index=True)
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     sources_count = Column(Integer, default=0)
     response_time = Column(Float)  # en secondes
     confidence_score = Column(Float)  # score de confiance de la réponse
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Métadonnées pour l'évaluation
     tokens_used = Column(Integer)
     model_used = Column(String)
     retrieval_method = Column(String, default="similarity")
+    cache_hit = Column(Boolean)  # réponse servie par le cache LLM (NULL si non mesuré, ex. streaming)
     
     # Relations
     session = relationship("ChatSession", back_populates="conversations")
 
+# Historique d'une session, du plus récent au plus ancien
+Index("ix_conv_session_time", Conversation.session_id, Conversation.timestamp.desc())
+
 class EvaluationMetric(Base):
     """Modèle pour stocker les métriques d'évaluation des réponses."""
     __tablename__ = "evaluation_metrics"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
+    id = Column(String, primary_key=True, default=new_id)
+    conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False, index=True)
     
     # Métriques RAG
     relevance_score = Column(Float)  # Pertinence de la réponse
@@ -103,18 +156,55 @@ def get_db():
     finally:
         db.close()
 
+def bulk_record_conversations(db, rows: List[dict]):
+    """
+    Insère plusieurs conversations en une seule instruction INSERT (executemany, sans ORM).
+    Les valeurs par défaut (id, timestamp...) sont appliquées ligne par ligne.
+    """
+    if not rows:
+        return
+    
+    if db.bind.dialect.name == "postgresql":
+        statement = postgresql.insert(Conversation).on_conflict_do_nothing()
+    else:
+        statement = insert(Conversation)
+    
+    db.execute(statement, rows)
+
 def create_tables():
     """Crée toutes les tables de la base de données."""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all ne modifie pas non plus les tables existantes : ajouter les colonnes manquantes
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}"
+                    )
+    
+    # create_all ignore les index des tables déjà existantes : les ajouter si besoin
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 def get_session_stats():
     """Retourne des statistiques globales sur les sessions."""
     db = SessionLocal()
     try:
-        total_sessions = db.query(ChatSession).count()
-        total_documents = db.query(Document).count()
-        total_conversations = db.query(Conversation).count()
-        active_sessions = db.query(ChatSession).filter(ChatSession.is_active == True).count()
+        # Les quatre comptages en une seule requête (sous-requêtes scalaires)
+        total_sessions, total_documents, total_conversations, active_sessions = db.execute(
+            select(
+                select(func.count()).select_from(ChatSession).scalar_subquery(),
+                select(func.count()).select_from(Document).scalar_subquery(),
+                select(func.count()).select_from(Conversation).scalar_subquery(),
+                select(func.count()).select_from(ChatSession)
+                .where(ChatSession.is_active == True).scalar_subquery()
+            )
+        ).one()
         
         return {
             "total_sessions": total_sessions,
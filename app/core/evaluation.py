@@ -3,15 +3,50 @@ Système d'évaluation avancé pour les réponses RAG.
 """
 
 import time
+import asyncio
 from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 import structlog
-from rouge_score import rouge_scorer
+from rouge_score import rouge_scorer, tokenizers
 import json
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 
 logger = structlog.get_logger(__name__)
 
+# Appels au juge LLM en vol simultanément lors d'une évaluation groupée
+JUDGE_BATCH_WORKERS = 16
+
+# Textes dont la tokenisation ROUGE (avec stemming) est gardée en mémoire
+ROUGE_TOKEN_CACHE_SIZE = 256
+
+
+class _CachedRougeTokenizer(tokenizers.Tokenizer):
+    """
+    Tokenizer ROUGE par défaut (stemming Porter) dont les résultats sont mémoïsés.
+    
+    Passé à RougeScorer par son paramètre public `tokenizer` : une même réponse de
+    référence, évaluée contre plusieurs réponses ou à chaque run, n'est tokenisée qu'une fois.
+    """
+    
+    def __init__(self, use_stemmer: bool = True):
+        default_tokenizer = tokenizers.DefaultTokenizer(use_stemmer)
+        self._tokenize = lru_cache(maxsize=ROUGE_TOKEN_CACHE_SIZE)(
+            lambda text: tuple(default_tokenizer.tokenize(text))
+        )
+    
+    def tokenize(self, text: str) -> List[str]:
+        # Copie : le cache est partagé entre threads d'évaluation
+        return list(self._tokenize(text))
+
+
+def _tokenize(text: str) -> frozenset:
+    """Ensemble des mots (minuscules) d'un texte, calculé une seule fois par appel."""
+    return frozenset(text.lower().split())
+
+
 @dataclass
 class EvaluationResult:
     """Résultat d'évaluation d'une réponse RAG."""
@@ -23,12 +58,15 @@ class EvaluationResult:
     overall_score: float
     evaluation_time: float
     timestamp: datetime
+    # Vrai si un score a été obtenu par repli (heuristique ou valeurs par défaut) au lieu du juge LLM
+    degraded: bool = False
 
 class RAGEvaluator:
     """Évaluateur de qualité pour les réponses RAG."""
     
     def __init__(self, llm_evaluator=None):
-        self.rouge_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+        self.rouge_tokenizer = _CachedRougeTokenizer(use_stemmer=True)
+        self.rouge_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], tokenizer=self.rouge_tokenizer)
         self.llm_evaluator = llm_evaluator  # LLM pour évaluation sémantique
         
         # Prompts d'évaluation
@@ -59,6 +97,20 @@ class RAGEvaluator:
         
         Répondez uniquement par un nombre entre 0 et 1:
         """
+        
+        # Prompt unique pertinence + fidélité (un seul aller-retour LLM)
+        self.combined_prompt = """
+        Évaluez cette réponse sur une échelle de 0 à 1 selon deux critères.
+        
+        Question: {question}
+        Réponse: {answer}
+        Sources: {sources}
+        
+        - relevance : la réponse adresse-t-elle directement la question, sans information hors sujet?
+        - faithfulness : la réponse est-elle supportée par les sources, sans hallucination?
+        
+        Répondez uniquement par un objet JSON de la forme {{"relevance": 0.0, "faithfulness": 0.0}}
+        """
 
     def evaluate_response(self, 
                          question: str, 
@@ -73,11 +125,14 @@ class RAGEvaluator:
         logger.info("Starting response evaluation", question_length=len(question), answer_length=len(answer))
         
         try:
-            # 1. Évaluation de la pertinence
-            relevance_score = self._evaluate_relevance(question, answer)
-            
-            # 2. Évaluation de la fidélité aux sources
-            faithfulness_score = self._evaluate_faithfulness(answer, sources)
+            # 1-2. Pertinence et fidélité : un seul appel LLM quand c'est possible
+            fallbacks: List[str] = []
+            scores = self._evaluate_with_llm(question, answer, sources)
+            if scores is not None:
+                relevance_score, faithfulness_score = scores
+            else:
+                relevance_score = self._evaluate_relevance(question, answer, fallbacks)
+                faithfulness_score = self._evaluate_faithfulness(answer, sources, fallbacks)
             
             # 3. Précision et rappel du contexte
             context_precision, context_recall = self._evaluate_context_quality(question, sources)
@@ -102,7 +157,8 @@ class RAGEvaluator:
                 rouge_scores=rouge_scores,
                 overall_score=overall_score,
                 evaluation_time=evaluation_time,
-                timestamp=datetime.utcnow()
+                timestamp=datetime.utcnow(),
+                degraded=bool(fallbacks)
             )
             
             logger.info("Response evaluation completed", 
@@ -122,11 +178,192 @@ class RAGEvaluator:
                 rouge_scores={},
                 overall_score=0.5,
                 evaluation_time=time.time() - start_time,
-                timestamp=datetime.utcnow()
+                timestamp=datetime.utcnow(),
+                degraded=True
+            )
+
+    def evaluate_batch(self, payloads: List[Dict[str, Any]],
+                       max_workers: int = JUDGE_BATCH_WORKERS) -> List[EvaluationResult]:
+        """
+        Évalue un lot de réponses en parallèle (les appels au juge LLM sont limités par le réseau).
+        
+        Args:
+            payloads: Dictionnaires avec les arguments de evaluate_response
+                      (question, answer, sources, reference_answer optionnelle)
+            max_workers: Nombre maximum d'évaluations simultanées
+            
+        Returns:
+            Résultats d'évaluation, dans l'ordre des payloads
+        """
+        if not payloads:
+            return []
+        
+        logger.info("Starting batch evaluation", batch_size=len(payloads))
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(payloads)))) as executor:
+            return list(executor.map(lambda payload: self.evaluate_response(**payload), payloads))
+
+    async def aevaluate_response(self, 
+                                 question: str, 
+                                 answer: str, 
+                                 sources: List[Dict], 
+                                 reference_answer: str = None) -> EvaluationResult:
+        """
+        Version asynchrone de evaluate_response : les évaluations LLM et les métriques
+        locales (contexte, ROUGE) sont lancées en parallèle au lieu de s'enchaîner.
+        """
+        start_time = time.time()
+        
+        logger.info("Starting async response evaluation", question_length=len(question), answer_length=len(answer))
+        
+        try:
+            async def rouge() -> Dict[str, float]:
+                if not reference_answer:
+                    return {}
+                return await asyncio.to_thread(self._calculate_rouge_scores, answer, reference_answer)
+            
+            fallbacks: List[str] = []
+            
+            async def llm_scores() -> tuple:
+                scores = await self._aevaluate_with_llm(question, answer, sources)
+                if scores is not None:
+                    return scores
+                return await asyncio.gather(
+                    self._aevaluate_relevance(question, answer, fallbacks),
+                    self._aevaluate_faithfulness(answer, sources, fallbacks)
+                )
+            
+            (relevance_score, faithfulness_score), (context_precision, context_recall), rouge_scores = await asyncio.gather(
+                llm_scores(),
+                asyncio.to_thread(self._evaluate_context_quality, question, sources),
+                rouge()
+            )
+            
+            overall_score = self._calculate_overall_score(
+                relevance_score, faithfulness_score, context_precision, context_recall
+            )
+            
+            evaluation_time = time.time() - start_time
+            
+            logger.info("Async response evaluation completed", 
+                       overall_score=overall_score,
+                       evaluation_time=evaluation_time)
+            
+            return EvaluationResult(
+                relevance_score=relevance_score,
+                faithfulness_score=faithfulness_score,
+                context_precision=context_precision,
+                context_recall=context_recall,
+                rouge_scores=rouge_scores,
+                overall_score=overall_score,
+                evaluation_time=evaluation_time,
+                timestamp=datetime.utcnow(),
+                degraded=bool(fallbacks)
+            )
+            
+        except Exception as e:
+            logger.error("Async response evaluation failed", error=str(e))
+            return EvaluationResult(
+                relevance_score=0.5,
+                faithfulness_score=0.5,
+                context_precision=0.5,
+                context_recall=0.5,
+                rouge_scores={},
+                overall_score=0.5,
+                evaluation_time=time.time() - start_time,
+                timestamp=datetime.utcnow(),
+                degraded=True
             )
 
-    def _evaluate_relevance(self, question: str, answer: str) -> float:
-        """Évalue la pertinence de la réponse par rapport à la question."""
+    async def _aevaluate_relevance(self, question: str, answer: str,
+                                   fallbacks: Optional[List[str]] = None) -> float:
+        """Version asynchrone de _evaluate_relevance."""
+        if not self.llm_evaluator:
+            return self._heuristic_relevance(question, answer)
+        
+        try:
+            prompt = self.relevance_prompt.format(question=question, answer=answer)
+            result = await self.llm_evaluator.ainvoke(prompt)
+            return max(0.0, min(1.0, float(result.strip())))
+            
+        except Exception as e:
+            logger.warning("LLM relevance evaluation failed, using heuristic", error=str(e))
+            if fallbacks is not None:
+                fallbacks.append("relevance")
+            return self._heuristic_relevance(question, answer)
+
+    async def _aevaluate_faithfulness(self, answer: str, sources: List[Dict],
+                                      fallbacks: Optional[List[str]] = None) -> float:
+        """Version asynchrone de _evaluate_faithfulness."""
+        if not sources:
+            return 0.0
+            
+        if not self.llm_evaluator:
+            return self._heuristic_faithfulness(answer, sources)
+        
+        try:
+            sources_text = "\n".join([src.get("content", "") for src in sources])
+            prompt = self.faithfulness_prompt.format(answer=answer, sources=sources_text)
+            result = await self.llm_evaluator.ainvoke(prompt)
+            return max(0.0, min(1.0, float(result.strip())))
+            
+        except Exception as e:
+            logger.warning("LLM faithfulness evaluation failed, using heuristic", error=str(e))
+            if fallbacks is not None:
+                fallbacks.append("faithfulness")
+            return self._heuristic_faithfulness(answer, sources)
+
+    def _evaluate_with_llm(self, question: str, answer: str, sources: List[Dict]) -> Optional[tuple]:
+        """
+        Évalue pertinence et fidélité en un seul appel LLM (réponse JSON).
+        Retourne None si aucun LLM n'est configuré, s'il n'y a pas de sources
+        ou si la réponse est inexploitable : l'appelant repasse alors par les évaluations séparées.
+        """
+        if not self.llm_evaluator or not sources:
+            return None
+        
+        try:
+            result = self.llm_evaluator.invoke(self._combined_prompt(question, answer, sources))
+            return self._parse_combined_scores(result)
+        except Exception as e:
+            logger.warning("Combined LLM evaluation failed, falling back to separate scorers", error=str(e))
+            return None
+
+    async def _aevaluate_with_llm(self, question: str, answer: str, sources: List[Dict]) -> Optional[tuple]:
+        """Version asynchrone de _evaluate_with_llm."""
+        if not self.llm_evaluator or not sources:
+            return None
+        
+        try:
+            result = await self.llm_evaluator.ainvoke(self._combined_prompt(question, answer, sources))
+            return self._parse_combined_scores(result)
+        except Exception as e:
+            logger.warning("Combined LLM evaluation failed, falling back to separate scorers", error=str(e))
+            return None
+
+    def _combined_prompt(self, question: str, answer: str, sources: List[Dict]) -> str:
+        sources_text = "\n".join([src.get("content", "") for src in sources])
+        return self.combined_prompt.format(question=question, answer=answer, sources=sources_text)
+
+    @staticmethod
+    def _parse_combined_scores(result) -> tuple:
+        """Extrait (pertinence, fidélité) de la réponse JSON du LLM, bornés entre 0 et 1."""
+        text = getattr(result, "content", result).strip()
+        # Tolérer un bloc de code markdown autour du JSON
+        text = text[text.index("{"):text.rindex("}") + 1]
+        scores = json.loads(text)
+        return (
+            max(0.0, min(1.0, float(scores["relevance"]))),
+            max(0.0, min(1.0, float(scores["faithfulness"])))
+        )
+
+    def _evaluate_relevance(self, question: str, answer: str,
+                            fallbacks: Optional[List[str]] = None) -> float:
+        """
+        Évalue la pertinence de la réponse par rapport à la question.
+        
+        Si le juge LLM échoue, "relevance" est ajouté à `fallbacks` (score heuristique).
+        """
         if not self.llm_evaluator:
             # Méthode heuristique simple
             return self._heuristic_relevance(question, answer)
@@ -142,10 +379,17 @@ class RAGEvaluator:
             
         except Exception as e:
             logger.warning("LLM relevance evaluation failed, using heuristic", error=str(e))
+            if fallbacks is not None:
+                fallbacks.append("relevance")
             return self._heuristic_relevance(question, answer)
 
-    def _evaluate_faithfulness(self, answer: str, sources: List[Dict]) -> float:
-        """Évalue la fidélité de la réponse aux sources."""
+    def _evaluate_faithfulness(self, answer: str, sources: List[Dict],
+                               fallbacks: Optional[List[str]] = None) -> float:
+        """
+        Évalue la fidélité de la réponse aux sources.
+        
+        Si le juge LLM échoue, "faithfulness" est ajouté à `fallbacks` (score heuristique).
+        """
         if not sources:
             return 0.0
             
@@ -163,6 +407,8 @@ class RAGEvaluator:
             
         except Exception as e:
             logger.warning("LLM faithfulness evaluation failed, using heuristic", error=str(e))
+            if fallbacks is not None:
+                fallbacks.append("faithfulness")
             return self._heuristic_faithfulness(answer, sources)
 
     def _evaluate_context_quality(self, question: str, sources: List[Dict]) -> tuple:
@@ -171,23 +417,21 @@ class RAGEvaluator:
             return 0.0, 0.0
         
         # Méthode simple basée sur la présence de mots-clés
-        question_words = set(question.lower().split())
+        question_words = _tokenize(question)
+        if not question_words:
+            return 0.0, 0.0
         
-        relevant_sources = 0
-        total_relevance = 0
+        # Intersection calculée en C directement sur les tokens de chaque source
+        overlaps = [
+            len(question_words.intersection(source.get("content", "").lower().split()))
+            for source in sources
+        ]
         
-        for source in sources:
-            content = source.get("content", "").lower()
-            content_words = set(content.split())
-            
-            # Intersection des mots
-            overlap = len(question_words.intersection(content_words))
-            if overlap > 0:
-                relevant_sources += 1
-                total_relevance += overlap / len(question_words)
+        relevant_sources = sum(1 for overlap in overlaps if overlap)
+        total_relevance = sum(overlaps) / len(question_words)
         
-        precision = relevant_sources / len(sources) if sources else 0
-        recall = total_relevance / len(sources) if sources else 0
+        precision = relevant_sources / len(sources)
+        recall = total_relevance / len(sources)
         
         return precision, recall
 
@@ -223,13 +467,12 @@ class RAGEvaluator:
 
     def _heuristic_relevance(self, question: str, answer: str) -> float:
         """Méthode heuristique pour évaluer la pertinence."""
-        question_words = set(question.lower().split())
-        answer_words = set(answer.lower().split())
+        question_words = _tokenize(question)
         
         if not question_words:
             return 0.0
         
-        overlap = len(question_words.intersection(answer_words))
+        overlap = len(question_words.intersection(answer.lower().split()))
         return min(1.0, overlap / len(question_words))
 
     def _heuristic_faithfulness(self, answer: str, sources: List[Dict]) -> float:
@@ -237,17 +480,15 @@ class RAGEvaluator:
         if not sources:
             return 0.0
         
-        answer_words = set(answer.lower().split())
-        source_words = set()
-        
-        for source in sources:
-            content = source.get("content", "").lower()
-            source_words.update(content.split())
-        
+        answer_words = _tokenize(answer)
         if not answer_words:
             return 1.0
         
-        overlap = len(answer_words.intersection(source_words))
+        source_words = frozenset(chain.from_iterable(
+            source.get("content", "").lower().split() for source in sources
+        ))
+        
+        overlap = len(answer_words & source_words)
         return overlap / len(answer_words)
 
 class MetricsCollector:
@@ -263,9 +504,13 @@ class MetricsCollector:
             "total_documents": 0,
             "total_chunks": 0
         }
-        self.response_times = []
-        self.confidence_scores = []
-        self.evaluation_scores = []
+        # Compteurs cumulés : mise à jour en O(1), mémoire constante
+        self._response_time_sum = 0.0
+        self._response_time_count = 0
+        self._confidence_sum = 0.0
+        self._confidence_count = 0
+        self._evaluation_sum = 0.0
+        self._evaluation_count = 0
         self.error_count = 0
 
     def record_question(self, response_time: float, confidence_score: float, 
@@ -276,11 +521,14 @@ class MetricsCollector:
         if error:
             self.error_count += 1
         else:
-            self.response_times.append(response_time)
-            self.confidence_scores.append(confidence_score)
+            self._response_time_sum += response_time
+            self._response_time_count += 1
+            self._confidence_sum += confidence_score
+            self._confidence_count += 1
             
             if evaluation_score:
-                self.evaluation_scores.append(evaluation_score)
+                self._evaluation_sum += evaluation_score
+                self._evaluation_count += 1
         
         # Mettre à jour les moyennes
         self._update_averages()
@@ -292,14 +540,14 @@ class MetricsCollector:
 
     def _update_averages(self):
         """Met à jour les moyennes calculées."""
-        if self.response_times:
-            self.metrics["avg_response_time"] = sum(self.response_times) / len(self.response_times)
+        if self._response_time_count:
+            self.metrics["avg_response_time"] = self._response_time_sum / self._response_time_count
         
-        if self.confidence_scores:
-            self.metrics["avg_confidence_score"] = sum(self.confidence_scores) / len(self.confidence_scores)
+        if self._confidence_count:
+            self.metrics["avg_confidence_score"] = self._confidence_sum / self._confidence_count
         
-        if self.evaluation_scores:
-            self.metrics["avg_evaluation_score"] = sum(self.evaluation_scores) / len(self.evaluation_scores)
+        if self._evaluation_count:
+            self.metrics["avg_evaluation_score"] = self._evaluation_sum / self._evaluation_count
         
         if self.metrics["total_questions"] > 0:
             self.metrics["error_rate"] = self.error_count / self.metrics["total_questions"]
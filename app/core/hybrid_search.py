@@ -4,13 +4,338 @@ Cette approche améliore significativement la pertinence des résultats.
 """
 
 from typing import List, Dict, Any, Tuple
-from rank_bm25 import BM25Okapi
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from langchain.schema import Document
+from numba import njit
 import numpy as np
+import hashlib
+import os
+import queue
+import threading
+import time
+import torch
+import xxhash
 import structlog
 
 logger = structlog.get_logger(__name__)
 
+# Ce module ne fait que de l'inférence : pas d'autograd, kernels oneDNN sur CPU
+torch.set_grad_enabled(False)
+torch.backends.mkldnn.enabled = True
+
+# Variante int8 (quantification dynamique AVX-512 VNNI) publiée avec les cross-encoders sentence-transformers
+ONNX_QINT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+RERANK_BATCH_SIZE = 64
+# Micro-batching : fenêtre de regroupement (s) et taille maximale d'un lot coalescé
+RERANK_BATCH_WINDOW = 0.005
+RERANK_MAX_BATCH_PAIRS = 256
+# Longueur maximale (tokens) d'une paire query + document
+RERANK_MAX_LENGTH = 512
+
+# Tailles des caches LRU : embeddings de requête, scores du cross-encoder, top BM25 par requête
+# (une entrée BM25 ne garde que max(k, RRF_CANDIDATES) couples indice/score, pas un tableau par document)
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+RERANK_SCORE_CACHE_SIZE = 8192
+BM25_QUERY_CACHE_SIZE = 512
+# Index BM25 conservés en mémoire (un par corpus)
+BM25_INDEX_CACHE_SIZE = 8
+# Index BM25 persistés, un fichier par empreinte de corpus (les anciens restent valides)
+BM25_CACHE_DIR = "./cache/bm25"
+
+# Candidats sémantiques demandés à Chroma : max(k * facteur, minimum), bornés par la taille du corpus
+SEMANTIC_CANDIDATES_FACTOR = 10
+SEMANTIC_MIN_CANDIDATES = 200
+# Premiers résultats BM25 retenus pour la fusion RRF
+RRF_CANDIDATES = 200
+# Threads de recherche sémantique partagés par tous les retrievers (créés à la demande)
+SEMANTIC_SEARCH_WORKERS = 4
+
+
+def _tokenize(text: str) -> List[str]:
+    """Tokenisation BM25 : minuscules puis découpage sur les espaces."""
+    return text.lower().split()
+
+
+@njit(cache=True, fastmath=True)
+def _accumulate_postings(indptr, indices, data, term_ids, n_docs):
+    """Somme, par document, des contributions BM25 des lignes CSR de la requête."""
+    scores = np.zeros(n_docs)
+    for t in term_ids:
+        for j in range(indptr[t], indptr[t + 1]):
+            scores[indices[j]] += data[j]
+    return scores
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices des k meilleurs scores, décroissants : sélection partielle O(N), puis tri des k seuls."""
+    if k < len(scores):
+        idx = np.argpartition(scores, -k)[-k:]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx])]
+
+
+class BM25Index:
+    """
+    BM25 Okapi vectorisé, aux scores identiques à rank_bm25.BM25Okapi.
+    
+    Tout ce qui ne dépend pas de la requête (idf, normalisation par longueur, tf)
+    est calculé à l'indexation. Les postings sont stockés en CSR : les termes sont
+    remplacés par des identifiants int32 (``term2id``) et la ligne ``t`` de
+    ``(indptr, indices, data)`` donne les documents du terme et leur contribution
+    BM25 déjà pondérée. Scorer une requête revient à parcourir ces lignes
+    dans un noyau Numba compilé.
+    """
+    
+    def __init__(self, tokenized_docs: List[List[str]], k1: float = 1.5, b: float = 0.75,
+                 epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = len(tokenized_docs)
+        
+        doc_len = np.array([len(tokens) for tokens in tokenized_docs], dtype=np.float64)
+        self.avgdl = doc_len.mean() if self.corpus_size else 0.0
+        len_norm = k1 * (1 - b + b * doc_len / self.avgdl) if self.avgdl else np.full(self.corpus_size, k1)
+        
+        # Triplets (terme, document, fréquence), termes convertis en identifiants
+        self.term2id: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        freqs: List[int] = []
+        for doc_idx, tokens in enumerate(tokenized_docs):
+            counts = Counter(tokens)
+            term_ids.extend(self.term2id.setdefault(term, len(self.term2id)) for term in counts)
+            freqs.extend(counts.values())
+            doc_ids.extend([doc_idx] * len(counts))
+        
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tf = np.asarray(freqs, dtype=np.float64)
+        
+        # Regrouper par terme (tri stable : documents croissants dans chaque ligne)
+        order = np.argsort(term_ids, kind="stable")
+        doc_freqs = np.bincount(term_ids, minlength=len(self.term2id))
+        self.indptr = np.zeros(len(self.term2id) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=self.indptr[1:])
+        
+        self.idf = self._compute_idf(doc_freqs)
+        self.indices = doc_ids[order]
+        self.data = (
+            self.idf[term_ids] * tf * (k1 + 1) / (tf + len_norm[doc_ids])
+        )[order]
+        
+        # Compile le noyau à l'indexation plutôt qu'à la première requête (no-op si déjà en cache)
+        _accumulate_postings(self.indptr, self.indices, self.data, np.empty(0, dtype=np.int64), 0)
+
+    def save(self, path: str):
+        """Écrit l'index (CSR, idf, vocabulaire) dans un .npz, de façon atomique."""
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            indptr=self.indptr, indices=self.indices, data=self.data, idf=self.idf,
+            # Vocabulaire en un seul bloc UTF-8 séparé par des sauts de ligne (les tokens n'en contiennent pas) :
+            # un tableau <U{n}> réserverait 4 octets x le plus long token pour chaque terme
+            vocab=np.frombuffer("\n".join(self.term2id).encode("utf-8"), dtype=np.uint8),
+            params=np.array([self.k1, self.b, self.epsilon, self.corpus_size, self.avgdl])
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Recharge un index écrit par save, sans retokeniser le corpus."""
+        index = cls.__new__(cls)
+        with np.load(path) as arrays:
+            index.indptr = arrays["indptr"]
+            index.indices = arrays["indices"]
+            index.data = arrays["data"]
+            index.idf = arrays["idf"]
+            vocab = arrays["vocab"]
+            if vocab.dtype != np.uint8:
+                raise ValueError("obsolete BM25 index format")
+            text = vocab.tobytes().decode("utf-8")
+            index.term2id = {term: i for i, term in enumerate(text.split("\n"))} if text else {}
+            k1, b, epsilon, corpus_size, avgdl = arrays["params"].tolist()
+        index.k1, index.b, index.epsilon, index.avgdl = k1, b, epsilon, avgdl
+        index.corpus_size = int(corpus_size)
+        return index
+
+    def _compute_idf(self, doc_freqs: np.ndarray) -> np.ndarray:
+        """IDF Okapi ; les valeurs négatives (termes très fréquents) sont ramenées à epsilon * idf moyen."""
+        idf = np.log(self.corpus_size - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        if idf.size:
+            idf[idf < 0] = self.epsilon * idf.mean()
+        return idf
+
+    def get_scores(self, tokenized_query: List[str]) -> np.ndarray:
+        """Scores BM25 de la requête pour tous les documents."""
+        term_ids = np.fromiter(
+            (self.term2id[term] for term in tokenized_query if term in self.term2id), dtype=np.int64
+        )
+        return _accumulate_postings(self.indptr, self.indices, self.data, term_ids, self.corpus_size)
+
+
+def _corpus_fingerprint(contents: List[str]) -> str:
+    """Empreinte sha256 du contenu ordonné des documents."""
+    hasher = hashlib.sha256()
+    for content in contents:
+        hasher.update(content.encode("utf-8"))
+        hasher.update(b"\x00")
+    return hasher.hexdigest()
+
+
+_BM25_CACHE: "OrderedDict[str, BM25Index]" = OrderedDict()
+_BM25_CACHE_LOCK = threading.Lock()
+
+
+def _get_bm25_index(contents: List[str]) -> BM25Index:
+    """Index BM25 du corpus, construit une seule fois par empreinte (LRU mémoire puis cache disque)."""
+    fingerprint = _corpus_fingerprint(contents)
+    with _BM25_CACHE_LOCK:
+        index = _BM25_CACHE.get(fingerprint)
+        if index is not None:
+            _BM25_CACHE.move_to_end(fingerprint)
+            return index
+    
+    # Index persisté par un démarrage précédent : ni tokenisation ni statistiques à recalculer
+    path = os.path.join(BM25_CACHE_DIR, f"bm25_{fingerprint}.npz")
+    index = None
+    if os.path.exists(path):
+        try:
+            index = BM25Index.load(path)
+        except Exception as e:
+            logger.warning("BM25 index cache unreadable, rebuilding", path=path, error=str(e))
+    
+    if index is None:
+        # map évite la boucle Python de la compréhension
+        index = BM25Index(list(map(_tokenize, contents)))
+        try:
+            os.makedirs(BM25_CACHE_DIR, exist_ok=True)
+            index.save(path)
+        except OSError as e:
+            logger.warning("BM25 index cache not written", path=path, error=str(e))
+    
+    with _BM25_CACHE_LOCK:
+        _BM25_CACHE[fingerprint] = index
+        while len(_BM25_CACHE) > BM25_INDEX_CACHE_SIZE:
+            _BM25_CACHE.popitem(last=False)
+    return index
+
+
+@lru_cache(maxsize=None)
+def _load_cross_encoder(model_name: str) -> Tuple[Any, str]:
+    """CrossEncoder chargé une fois par processus ; renvoie (modèle, backend)."""
+    from sentence_transformers import CrossEncoder
+    
+    # Sur GPU : poids en FP16
+    if torch.cuda.is_available():
+        model = CrossEncoder(model_name, device="cuda")
+        model.model.half()
+        return model, "cuda-fp16"
+    
+    # Sur CPU : graphe ONNX quantifié int8 (fusions ONNX Runtime + instructions VNNI)
+    try:
+        model = CrossEncoder(model_name, backend="onnx",
+                             model_kwargs={"file_name": ONNX_QINT8_FILE})
+        return model, "onnx-int8"
+    except Exception as e:
+        logger.warning("ONNX int8 cross-encoder unavailable, using PyTorch FP32", error=str(e))
+        # Un thread par cœur physique (≈ moitié des cœurs logiques avec l'hyperthreading)
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // 2))
+        return CrossEncoder(model_name), "torch"
+
+
+class _PredictBatcher:
+    """
+    Micro-batching des appels au cross-encoder.
+    
+    Les paires de requêtes concurrentes sont regroupées pendant une courte fenêtre
+    (ou jusqu'à RERANK_MAX_BATCH_PAIRS paires) puis scorées ensemble ; chaque
+    appelant récupère sa tranche de résultats via un Future.
+    
+    Le tokenizer rapide et le modèle sous-jacent sont appelés directement,
+    sans passer par CrossEncoder.predict ni construire de liste de paires.
+    Les scores sont les logits bruts (l'activation monotone de predict
+    ne change pas l'ordre).
+    """
+    
+    def __init__(self, model, batch_size: int):
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Tuple[str, List[str], Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="cross-encoder-batcher", daemon=True)
+        self._thread.start()
+    
+    def predict(self, query: str, texts: List[str]) -> np.ndarray:
+        """Scores des paires (query, texte), calculés dans le prochain lot."""
+        future: Future = Future()
+        self._queue.put((query, texts, future))
+        return future.result()
+    
+    def _score(self, queries: List[str], texts: List[str]) -> np.ndarray:
+        """Une passe tokenizer + modèle par tranche de batch_size paires."""
+        network = self.model.model
+        scores = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                enc = self.tokenizer(
+                    queries[start:start + self.batch_size],
+                    texts[start:start + self.batch_size],
+                    padding=True, truncation=True, max_length=RERANK_MAX_LENGTH,
+                    return_tensors="pt"
+                ).to(network.device)
+                logits = network(**enc).logits
+                scores.append(logits.squeeze(-1).float().cpu().numpy())
+        return np.concatenate(scores)
+    
+    def _run(self):
+        # Le mode autograd est propre à chaque thread : le désactiver aussi pour celui-ci
+        torch.set_grad_enabled(False)
+        while True:
+            requests = [self._queue.get()]
+            total = len(requests[0][1])
+            deadline = time.monotonic() + RERANK_BATCH_WINDOW
+            try:
+                while total < RERANK_MAX_BATCH_PAIRS:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    request = self._queue.get(timeout=remaining)
+                    requests.append(request)
+                    total += len(request[1])
+            except queue.Empty:
+                pass
+            
+            queries = [query for query, texts, _ in requests for _ in texts]
+            texts = [text for _, request_texts, _ in requests for text in request_texts]
+            try:
+                scores = self._score(queries, texts)
+            except Exception as e:
+                for _, _, future in requests:
+                    future.set_exception(e)
+                continue
+            
+            # Redistribuer les scores à chaque appelant
+            offset = 0
+            for _, request_texts, future in requests:
+                future.set_result(scores[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+@lru_cache(maxsize=None)
+def _get_predict_batcher(model_name: str, batch_size: int) -> _PredictBatcher:
+    """Un batcher (et son thread) par modèle et taille de lot."""
+    model, _ = _load_cross_encoder(model_name)
+    return _PredictBatcher(model, batch_size)
+
+
+# Un seul pool pour le processus : un pool par retriever laisserait ses threads vivants après lui
+_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=SEMANTIC_SEARCH_WORKERS, thread_name_prefix="hybrid-search")
+
+
 class HybridRetriever:
     """
     Retriever hybride combinant BM25 (keyword search) et recherche vectorielle (semantic search).
@@ -33,9 +358,37 @@ class HybridRetriever:
         self.k = k
         self.alpha = alpha
         
-        # Initialiser BM25
-        tokenized_docs = [doc.page_content.lower().split() for doc in documents]
-        self.bm25 = BM25Okapi(tokenized_docs)
+        # Contenus en tableau parallèle à self.documents : les boucles chaudes ne traversent pas les Document
+        self._contents: List[str] = [doc.page_content for doc in documents]
+        
+        # Empreinte xxh3 -> positions, pour retrouver en O(1) un document renvoyé par le vector store
+        # sans comparer les contenus caractère par caractère
+        self._hashes = np.fromiter(map(xxhash.xxh3_64_intdigest, self._contents), dtype=np.uint64,
+                                   count=len(self._contents))
+        self._hash_to_idx: Dict[int, List[int]] = {}
+        for i, content_hash in enumerate(self._hashes.tolist()):
+            self._hash_to_idx.setdefault(content_hash, []).append(i)
+        
+        # Cache LRU des embeddings de requête : une requête répétée ne rappelle pas l'API
+        self._cached_query_embedding = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(
+            lambda normalized_query: tuple(vector_store.embeddings.embed_query(normalized_query))
+        )
+        
+        # Initialiser BM25 (partagé entre retrievers construits sur le même corpus)
+        self.bm25 = _get_bm25_index(self._contents)
+        self._bm25_top_n = max(self.k, RRF_CANDIDATES)
+        self._cached_bm25_top = lru_cache(maxsize=BM25_QUERY_CACHE_SIZE)(self._compute_bm25_top)
+        
+        # Recherche sémantique exécutée en parallèle de BM25, sur le pool partagé du module
+        self._executor = _SEARCH_EXECUTOR
+        
+        # Stratégie choisie une fois pour toutes selon alpha
+        if alpha <= 0.0:
+            self._retrieve_impl = self._retrieve_bm25_only
+        elif alpha >= 1.0:
+            self._retrieve_impl = self._retrieve_semantic_only
+        else:
+            self._retrieve_impl = self._retrieve_hybrid
         
         logger.info("Hybrid retriever initialized", 
                    documents_count=len(documents),
@@ -52,17 +405,7 @@ class HybridRetriever:
         Returns:
             Liste des documents les plus pertinents
         """
-        # 1. Recherche BM25 (keyword-based)
-        bm25_scores = self._get_bm25_scores(query)
-        
-        # 2. Recherche sémantique (vector-based)
-        semantic_scores = self._get_semantic_scores(query)
-        
-        # 3. Fusionner les scores avec RRF (Reciprocal Rank Fusion)
-        combined_scores = self._reciprocal_rank_fusion(bm25_scores, semantic_scores)
-        
-        # 4. Sélectionner les top-k documents
-        top_indices = np.argsort(combined_scores)[-self.k:][::-1]
+        top_indices = self._retrieve_impl(query)
         
         results = [self.documents[i] for i in top_indices]
         
@@ -72,79 +415,154 @@ class HybridRetriever:
         
         return results
 
-    def _get_bm25_scores(self, query: str) -> np.ndarray:
-        """Calcule les scores BM25 pour tous les documents."""
-        tokenized_query = query.lower().split()
-        scores = self.bm25.get_scores(tokenized_query)
+    def _retrieve_hybrid(self, query: str) -> np.ndarray:
+        """Indices des top-k documents par fusion RRF de BM25 et de la recherche sémantique."""
+        # 1. Recherche sémantique (vector-based), limitée aux meilleurs candidats :
+        #    dominée par les I/O (embedding, Chroma), lancée en arrière-plan
+        semantic_future = self._executor.submit(self._get_semantic_scores, query)
+        
+        # 2. Recherche BM25 (keyword-based), calculée pendant ce temps
+        bm25_indices, _ = self._get_bm25_top(query)
+        semantic_indices, _ = semantic_future.result()
+        
+        # 3. Fusionner les scores avec RRF (Reciprocal Rank Fusion) sur l'union des candidats
+        candidates, combined_scores = self._reciprocal_rank_fusion(bm25_indices, semantic_indices)
+        
+        # 4. Sélectionner les top-k documents
+        return candidates[_top_k(combined_scores, self.k)]
+
+    def _retrieve_bm25_only(self, query: str) -> np.ndarray:
+        """alpha = 0 : la recherche sémantique ne pèserait rien, elle n'est pas lancée."""
+        bm25_indices, _ = self._get_bm25_top(query)
+        return bm25_indices[:self.k]
+
+    def _retrieve_semantic_only(self, query: str) -> np.ndarray:
+        """alpha = 1 : BM25 ne pèserait rien, le classement sémantique suffit."""
+        semantic_indices, _ = self._get_semantic_scores(query)
+        return semantic_indices[:self.k]
+
+    def _get_bm25_top(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Meilleurs documents BM25 de la requête (mémoïsés par requête).
+        
+        Returns:
+            (indices, scores normalisés entre 0 et 1) des max(k, RRF_CANDIDATES)
+            premiers documents, par score décroissant
+        """
+        return self._cached_bm25_top(query)
+
+    def _compute_bm25_top(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.bm25.get_scores(_tokenize(query))
+        
+        # Seul le haut du classement sert (top-k, fusion RRF) : le cache n'en garde pas plus
+        indices = _top_k(scores, self._bm25_top_n)
+        top_scores = scores[indices]
         
         # Normaliser les scores entre 0 et 1
-        if scores.max() > 0:
-            scores = scores / scores.max()
+        if top_scores.size and top_scores[0] > 0:
+            top_scores = top_scores / top_scores[0]
         
-        return scores
+        # Les tableaux sont partagés par le cache : lecture seule
+        indices.flags.writeable = False
+        top_scores.flags.writeable = False
+        return indices, top_scores
 
-    def _get_semantic_scores(self, query: str) -> np.ndarray:
-        """Calcule les scores de similarité sémantique."""
-        # Utiliser le vector store pour faire une recherche avec scores
-        results_with_scores = self.vector_store.similarity_search_with_score(
-            query, 
-            k=len(self.documents)  # Récupérer tous les documents avec scores
-        )
+    def embed_query(self, query: str) -> List[float]:
+        """Embedding de la requête, mémoïsé sur la requête normalisée (espaces)."""
+        return list(self._cached_query_embedding(" ".join(query.split())))
+
+    def _get_semantic_scores(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calcule les scores de similarité sémantique des meilleurs candidats.
+        
+        Seuls les top-M documents sont demandés à l'index HNSW : les autres n'ont
+        pas de rang sémantique et ne contribuent pas à la fusion.
+        
+        Returns:
+            (indices, scores) triés par similarité décroissante, chaque indice une seule fois
+        """
+        top_m = min(len(self.documents), max(self.k * SEMANTIC_CANDIDATES_FACTOR, SEMANTIC_MIN_CANDIDATES))
         
-        # Créer un tableau de scores aligné avec self.documents
-        scores = np.zeros(len(self.documents))
+        # Utiliser le vector store pour faire une recherche avec scores (embedding de requête mis en cache)
+        results_with_scores = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+            self.embed_query(query), 
+            k=top_m
+        )
         
+        indices: List[int] = []
+        similarities: List[float] = []
+        seen_hashes = set()
         for doc, score in results_with_scores:
-            # Trouver l'index de ce document
-            for i, orig_doc in enumerate(self.documents):
-                if orig_doc.page_content == doc.page_content:
-                    # ChromaDB retourne une distance, on la convertit en similarité
-                    scores[i] = 1 / (1 + score)  # Plus la distance est petite, plus le score est élevé
-                    break
+            # Chroma renvoie chaque copie d'un contenu dupliqué : seule la première (meilleur rang)
+            # est retenue, sans quoi chaque position serait classée autant de fois qu'il y a de copies
+            content_hash = xxhash.xxh3_64_intdigest(doc.page_content)
+            if content_hash in seen_hashes:
+                continue
+            seen_hashes.add(content_hash)
+            # Retrouver les positions de ce contenu (les doublons de contenu reçoivent le même score)
+            for i in self._hash_to_idx.get(content_hash, ()):
+                indices.append(i)
+                # ChromaDB retourne une distance, on la convertit en similarité
+                similarities.append(1 / (1 + score))  # Plus la distance est petite, plus le score est élevé
+        
+        scores = np.asarray(similarities, dtype=np.float64)
         
         # Normaliser
-        if scores.max() > 0:
+        if scores.size and scores.max() > 0:
             scores = scores / scores.max()
         
-        return scores
+        return np.asarray(indices, dtype=np.int64), scores
 
-    def _reciprocal_rank_fusion(self, bm25_scores: np.ndarray, 
-                                semantic_scores: np.ndarray, 
-                                k: int = 60) -> np.ndarray:
+    def _reciprocal_rank_fusion(self, bm25_indices: np.ndarray, 
+                                semantic_indices: np.ndarray, 
+                                k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
         """
         Fusionne les scores avec Reciprocal Rank Fusion.
         RRF(d) = sum(1 / (k + rank_i(d))) pour chaque ranking system i
         
+        Seuls les RRF_CANDIDATES premiers de BM25 et les candidats sémantiques sont
+        fusionnés : au-delà, 1 / (k + rang) est négligeable. Un document absent d'un
+        classement ne reçoit rien de ce classement.
+        
         Args:
-            bm25_scores: Scores BM25
-            semantic_scores: Scores sémantiques
+            bm25_indices: Indices des meilleurs documents BM25, du meilleur au moins bon
+            semantic_indices: Indices des candidats sémantiques, du plus au moins similaire,
+                              chacun présent une seule fois
             k: Constante de RRF (généralement 60)
             
         Returns:
-            Scores fusionnés
+            (indices des candidats, scores fusionnés)
         """
-        # Convertir les scores en rangs
-        bm25_ranks = np.argsort(np.argsort(bm25_scores)[::-1])
-        semantic_ranks = np.argsort(np.argsort(semantic_scores)[::-1])
-        
-        # Appliquer RRF
-        rrf_scores = np.zeros(len(bm25_scores))
-        
-        for i in range(len(bm25_scores)):
-            rrf_scores[i] = (
-                self.alpha / (k + semantic_ranks[i]) +
-                (1 - self.alpha) / (k + bm25_ranks[i])
-            )
+        # Le rang BM25 est la position dans le classement
+        bm25_top = bm25_indices[:RRF_CANDIDATES]
         
-        return rrf_scores
+        candidates = np.union1d(bm25_top, semantic_indices)
+        fused = np.zeros(len(candidates), dtype=np.float32)
+        fused[np.searchsorted(candidates, bm25_top)] += (
+            (1 - self.alpha) / (k + np.arange(len(bm25_top), dtype=np.float32))
+        )
+        # Contribution sémantique : le rang est la position dans la liste des candidats
+        # (chaque indice n'y figure qu'une fois, cf. _get_semantic_scores)
+        fused[np.searchsorted(candidates, semantic_indices)] += (
+            self.alpha / (k + np.arange(len(semantic_indices), dtype=np.float32))
+        )
+        return candidates, fused
 
-    def _weighted_fusion(self, bm25_scores: np.ndarray, 
-                        semantic_scores: np.ndarray) -> np.ndarray:
+    def _weighted_fusion(self, bm25_indices: np.ndarray, bm25_scores: np.ndarray,
+                        semantic_indices: np.ndarray,
+                        semantic_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Fusion simple par moyenne pondérée.
-        Alternative plus simple à RRF.
+        Fusion simple par moyenne pondérée, sur l'union des candidats.
+        Alternative plus simple à RRF (score nul hors des candidats d'une méthode).
+        
+        Returns:
+            (indices des candidats, scores fusionnés)
         """
-        return self.alpha * semantic_scores + (1 - self.alpha) * bm25_scores
+        candidates = np.union1d(bm25_indices, semantic_indices)
+        fused = np.zeros(len(candidates), dtype=np.float64)
+        fused[np.searchsorted(candidates, bm25_indices)] += (1 - self.alpha) * bm25_scores
+        fused[np.searchsorted(candidates, semantic_indices)] += self.alpha * semantic_scores
+        return candidates, fused
 
 
 class CrossEncoderReranker:
@@ -153,19 +571,25 @@ class CrossEncoderReranker:
     Le CrossEncoder évalue directement la pertinence query-document.
     """
     
-    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 batch_size: int = RERANK_BATCH_SIZE):
         """
         Initialise le reranker.
         
         Args:
             model_name: Nom du modèle CrossEncoder de Sentence-Transformers
+            batch_size: Nombre de paires (query, document) par passe d'inférence
         """
-        from sentence_transformers import CrossEncoder
+        self.model, self.backend = _load_cross_encoder(model_name)
+        self._batcher = _get_predict_batcher(model_name, batch_size)
         
-        self.model = CrossEncoder(model_name)
         self.model_name = model_name
+        self.batch_size = batch_size
+        # Scores (query, hash du contenu) -> pertinence, LRU
+        self._score_cache: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._score_lock = threading.Lock()
         
-        logger.info("CrossEncoder reranker initialized", model=model_name)
+        logger.info("CrossEncoder reranker initialized", model=model_name, backend=self.backend)
 
     def rerank(self, query: str, documents: List[Document], top_k: int = None) -> List[Document]:
         """
@@ -182,11 +606,25 @@ class CrossEncoderReranker:
         if not documents:
             return []
         
-        # Préparer les paires (query, document)
-        pairs = [[query, doc.page_content] for doc in documents]
-        
-        # Calculer les scores de pertinence
-        scores = self.model.predict(pairs)
+        # Scores déjà connus pour ces paires (query, document)
+        keys = [(query, hash(doc.page_content)) for doc in documents]
+        with self._score_lock:
+            scores = [self._score_cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        
+        if missing:
+            # Calculer les scores de pertinence des documents restants (regroupés avec les requêtes concurrentes)
+            new_scores = self._batcher.predict(query, [documents[i].page_content for i in missing])
+            for i, score in zip(missing, new_scores):
+                scores[i] = float(score)
+        
+        # Le reranker peut servir plusieurs requêtes concurrentes : LRU sous verrou
+        with self._score_lock:
+            for key, score in zip(keys, scores):
+                self._score_cache[key] = score
+                self._score_cache.move_to_end(key)
+            while len(self._score_cache) > RERANK_SCORE_CACHE_SIZE:
+                self._score_cache.popitem(last=False)
         
         # Trier les documents par score décroissant
         scored_docs = list(zip(documents, scores))
@@ -269,17 +707,27 @@ class HybridRAGPipeline:
         Returns:
             Dictionnaire avec les résultats de chaque méthode
         """
+        retriever = self.hybrid_retriever
+        
+        # Scores calculés une seule fois puis partagés par les trois méthodes :
+        # seule l'étape de fusion change
+        semantic_future = retriever._executor.submit(retriever._get_semantic_scores, query)
+        bm25_indices, _ = retriever._get_bm25_top(query)
+        semantic_indices, _ = semantic_future.result()
+        
         # 1. Recherche sémantique pure
-        semantic_results = self.vector_store.similarity_search(query, k=top_k)
+        semantic_results = [self.documents[i] for i in semantic_indices[:top_k]]
         
         # 2. Recherche BM25 pure
-        tokenized_query = query.lower().split()
-        bm25_scores = self.hybrid_retriever.bm25.get_scores(tokenized_query)
-        top_bm25_indices = np.argsort(bm25_scores)[-top_k:][::-1]
-        bm25_results = [self.documents[i] for i in top_bm25_indices]
+        bm25_results = [self.documents[i] for i in bm25_indices[:top_k]]
         
-        # 3. Hybrid search
-        hybrid_results = self.retrieve_and_rank(query, top_k)
+        # 3. Hybrid search (RRF puis reranking optionnel, comme retrieve_and_rank)
+        candidates, combined_scores = retriever._reciprocal_rank_fusion(bm25_indices, semantic_indices)
+        hybrid_candidates = [self.documents[i] for i in candidates[_top_k(combined_scores, retriever.k)]]
+        if self.use_reranking and self.reranker:
+            hybrid_results = self.reranker.rerank(query, hybrid_candidates, top_k=top_k)
+        else:
+            hybrid_results = hybrid_candidates[:top_k]
         
         return {
             "query": query,
@@ -3,17 +3,123 @@ Processeur multi-modal pour extraire et analyser images et tableaux des PDFs.
 Support de GPT-4 Vision pour l'analyse d'images.
 """
 
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import fitz  # PyMuPDF
-from PIL import Image
-import io
-import base64
+import numpy as np
+import os
+import re
+import binascii
+import multiprocessing
 from pathlib import Path
 import structlog
 from langchain_openai import ChatOpenAI
 
 logger = structlog.get_logger(__name__)
 
+# Pages par lot d'extraction d'images, et nombre d'images envoyées à la Vision API
+IMAGE_BATCH_PAGES = 10
+MAX_VISION_IMAGES = 3
+
+# En dessous de ce nombre de pages, démarrer des processus coûte plus que l'extraction elle-même
+PARALLEL_EXTRACTION_MIN_PAGES = 50
+
+# Résolution du rendu des pages en tableaux NumPy
+PAGE_RENDER_DPI = 150
+
+# Taille des tranches encodées en base64 : multiple de 3 pour ne pas produire de padding intermédiaire
+B64_CHUNK_SIZE = 48 * 1024
+
+
+def _stream_b64(data: bytes, chunk: int = B64_CHUNK_SIZE) -> str:
+    """Base64 par tranches dans un tampon préalloué (pas de copie intermédiaire de l'image)."""
+    view = memoryview(data)
+    out = bytearray(4 * ((len(data) + 2) // 3))
+    pos = 0
+    for i in range(0, len(data), chunk):
+        encoded = binascii.b2a_base64(view[i:i + chunk], newline=False)
+        out[pos:pos + len(encoded)] = encoded
+        pos += len(encoded)
+    return out.decode("ascii")
+
+
+def _raw_pixels(doc, xref: int) -> Tuple[bytes, int]:
+    """
+    Pixels décompressés d'une image (RGB/gris, + alpha éventuel), sans passer par un encodeur.
+    
+    Returns:
+        (octets des pixels, nombre de canaux)
+    """
+    pix = fitz.Pixmap(doc, xref)
+    if pix.n - pix.alpha >= 4:  # CMYK et autres : ramenés en RGB
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return pix.samples, pix.n
+
+
+def _extract_page_images(doc, page_num: int, output_dir: Optional[str],
+                         include_base64: bool = True,
+                         output_format: str = "native") -> List[Dict[str, Any]]:
+    """
+    Extrait les images d'une page d'un document PyMuPDF déjà ouvert.
+    
+    output_format : "native" (octets compressés tels que stockés dans le PDF, pour la
+    Vision API) ou "raw" (pixels décompressés, pour un modèle local).
+    """
+    images_info = []
+    
+    for img_index, img in enumerate(doc[page_num].get_images()):
+        xref = img[0]
+        base_image = doc.extract_image(xref)
+        
+        image_bytes = base_image["image"]
+        image_ext = base_image["ext"]
+        
+        # Informations sur l'image : dimensions fournies par PyMuPDF, sans décodage
+        image_info = {
+            "page": page_num + 1,
+            "index": img_index,
+            "width": base_image["width"],
+            "height": base_image["height"],
+            "format": image_ext,
+            "size_bytes": len(image_bytes)
+        }
+        
+        # Sauvegarder si demandé : les octets extraits sont déjà au format de l'extension
+        if output_dir:
+            output_path = Path(output_dir) / f"page{page_num+1}_img{img_index}.{image_ext}"
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.write_bytes(image_bytes)
+            image_info["filepath"] = str(output_path)
+        
+        if output_format == "raw":
+            image_bytes, channels = _raw_pixels(doc, xref)
+            image_info.update(format="raw", channels=channels)
+        
+        # Encoder en base64 pour transmission (octets d'origine ou pixels bruts, sans ré-encodage)
+        if include_base64:
+            image_info["base64"] = _stream_b64(image_bytes)
+        
+        images_info.append(image_info)
+    
+    return images_info
+
+
+def _extract_pages_images(pdf_path: str, start: int, stop: int, output_dir: Optional[str],
+                          include_base64: bool = True,
+                          output_format: str = "native") -> List[Dict[str, Any]]:
+    """
+    Extrait les images des pages [start, stop) d'un PDF.
+    
+    Fonction de module pour être exécutée dans un processus de pool : elle ouvre
+    son propre fitz.Document (un document PyMuPDF ne se partage pas entre processus).
+    """
+    with fitz.open(pdf_path) as doc:
+        return [
+            image_info
+            for page_num in range(start, stop)
+            for image_info in _extract_page_images(doc, page_num, output_dir, include_base64, output_format)
+        ]
+
+
 class MultiModalProcessor:
     """Processeur pour extraire et analyser le contenu multi-modal des PDFs."""
     
@@ -33,65 +139,50 @@ class MultiModalProcessor:
         
         logger.info("MultiModal processor initialized", use_vision=use_vision_api)
 
-    def extract_images_from_pdf(self, pdf_path: str, output_dir: str = None) -> List[Dict[str, Any]]:
+    def extract_images_from_pdf(self, pdf_path: str, output_dir: str = None,
+                                num_workers: int = min(os.cpu_count() or 1, 4),
+                                include_base64: bool = True,
+                                output_format: str = "native") -> List[Dict[str, Any]]:
         """
         Extrait toutes les images d'un PDF.
         
         Args:
             pdf_path: Chemin vers le PDF
             output_dir: Dossier où sauvegarder les images (optionnel)
+            num_workers: Nombre de processus d'extraction (1 = dans le processus courant ;
+                ignoré sous PARALLEL_EXTRACTION_MIN_PAGES pages)
+            include_base64: Joindre l'image encodée en base64 (inutile sans consommateur)
+            output_format: "native" (fichier image du PDF) ou "raw" (pixels décompressés)
             
         Returns:
             Liste de dictionnaires avec infos sur chaque image
         """
-        images_info = []
-        
         try:
-            doc = fitz.open(pdf_path)
+            with fitz.open(pdf_path) as doc:
+                page_count = len(doc)
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                image_list = page.get_images()
-                
-                for img_index, img in enumerate(image_list):
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
-                    
-                    # Créer l'objet Image PIL
-                    image = Image.open(io.BytesIO(image_bytes))
-                    
-                    # Informations sur l'image
-                    image_info = {
-                        "page": page_num + 1,
-                        "index": img_index,
-                        "width": image.width,
-                        "height": image.height,
-                        "format": image_ext,
-                        "size_bytes": len(image_bytes)
-                    }
-                    
-                    # Sauvegarder si demandé
-                    if output_dir:
-                        output_path = Path(output_dir) / f"page{page_num+1}_img{img_index}.{image_ext}"
-                        output_path.parent.mkdir(parents=True, exist_ok=True)
-                        image.save(output_path)
-                        image_info["filepath"] = str(output_path)
-                    
-                    # Encoder en base64 pour transmission
-                    buffered = io.BytesIO()
-                    image.save(buffered, format=image_ext.upper() if image_ext != "jpg" else "JPEG")
-                    image_info["base64"] = base64.b64encode(buffered.getvalue()).decode()
-                    
-                    images_info.append(image_info)
-            
-            doc.close()
+            if page_count < PARALLEL_EXTRACTION_MIN_PAGES:
+                num_workers = 1
+            num_workers = max(1, min(num_workers, page_count))
+            if num_workers == 1:
+                images_info = _extract_pages_images(pdf_path, 0, page_count, output_dir,
+                                                    include_base64, output_format)
+            else:
+                # Une plage de pages contiguë par processus, chacun ouvrant son propre document.
+                # "spawn" : pas de fork d'un serveur multi-thread (verrous hérités dans un état incohérent)
+                bounds = [page_count * i // num_workers for i in range(num_workers + 1)]
+                with multiprocessing.get_context("spawn").Pool(num_workers) as pool:
+                    results = pool.starmap(
+                        _extract_pages_images,
+                        [(pdf_path, start, stop, output_dir, include_base64, output_format)
+                         for start, stop in zip(bounds, bounds[1:])]
+                    )
+                images_info = [image_info for segment in results for image_info in segment]
             
             logger.info("Images extracted from PDF",
                        pdf_path=pdf_path,
-                       images_count=len(images_info))
+                       images_count=len(images_info),
+                       workers=num_workers)
             
             return images_info
             
@@ -99,6 +190,69 @@ class MultiModalProcessor:
             logger.error("Image extraction failed", pdf_path=pdf_path, error=str(e))
             return []
 
+    def iter_image_batches(self, pdf_path: str, batch_size: int = IMAGE_BATCH_PAGES,
+                           output_dir: str = None,
+                           include_base64: bool = True) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Extrait les images d'un PDF par lots de `batch_size` pages.
+        
+        Chaque lot est produit puis libéré avant le suivant : la mémoire reste
+        proportionnelle à un lot et non au document entier.
+        
+        Args:
+            pdf_path: Chemin vers le PDF
+            batch_size: Nombre de pages par lot
+            output_dir: Dossier où sauvegarder les images (optionnel)
+            include_base64: Joindre l'image encodée en base64
+            
+        Yields:
+            Liste des images (même format que extract_images_from_pdf) de chaque lot
+        """
+        for images_info, _ in self._process_doc(pdf_path, batch_size, tables=False,
+                                                output_dir=output_dir, include_base64=include_base64):
+            yield images_info
+
+    def _process_doc(self, pdf_path: str, batch_size: int = IMAGE_BATCH_PAGES,
+                     images: bool = True, tables: bool = True, output_dir: str = None,
+                     include_base64: bool = True) -> Iterator[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+        """
+        Parcourt le PDF une seule fois (un seul fitz.open, xref lue une fois) et produit,
+        par lot de pages, les images et les tableaux demandés.
+        
+        Yields:
+            (images du lot, tableaux du lot)
+        """
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+            for start in range(0, page_count, batch_size):
+                images_info, tables_info = [], []
+                for page_num in range(start, min(start + batch_size, page_count)):
+                    if images:
+                        images_info.extend(_extract_page_images(doc, page_num, output_dir, include_base64))
+                    if tables:
+                        tables_info.extend(self._extract_page_tables(doc[page_num], page_num))
+                yield images_info, tables_info
+
+    def render_pages_as_arrays(self, pdf_path: str, dpi: int = PAGE_RENDER_DPI) -> Iterator[np.ndarray]:
+        """
+        Rend chaque page en tableau NumPy (hauteur, largeur, canaux), page par page.
+        
+        Les pixels de PyMuPDF sont exposés tels quels (pas d'aller-retour PIL / BytesIO),
+        pour l'OCR ou un modèle de vision local.
+        
+        Args:
+            pdf_path: Chemin vers le PDF
+            dpi: Résolution du rendu
+            
+        Yields:
+            Tableau uint8 en lecture seule de chaque page
+        """
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                pix = page.get_pixmap(dpi=dpi)
+                # samples : copie unique des pixels, possédée par le tableau (survit au Pixmap)
+                yield np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
     def extract_tables_from_pdf(self, pdf_path: str) -> List[Dict[str, Any]]:
         """
         Extrait les tableaux d'un PDF.
@@ -109,29 +263,12 @@ class MultiModalProcessor:
         Returns:
             Liste de tableaux avec leurs métadonnées
         """
-        tables_info = []
-        
         try:
-            doc = fitz.open(pdf_path)
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # PyMuPDF ne détecte pas nativement les tableaux
-                # On utilise une heuristique basée sur le texte tabulaire
-                tables = self._detect_tables_heuristic(page)
-                
-                for table_index, table_data in enumerate(tables):
-                    table_info = {
-                        "page": page_num + 1,
-                        "index": table_index,
-                        "rows": len(table_data),
-                        "cols": len(table_data[0]) if table_data else 0,
-                        "data": table_data
-                    }
-                    tables_info.append(table_info)
-            
-            doc.close()
+            tables_info = [
+                table_info
+                for _, batch in self._process_doc(pdf_path, images=False)
+                for table_info in batch
+            ]
             
             logger.info("Tables extracted from PDF",
                        pdf_path=pdf_path,
@@ -143,6 +280,23 @@ class MultiModalProcessor:
             logger.error("Table extraction failed", pdf_path=pdf_path, error=str(e))
             return []
 
+    def _extract_page_tables(self, page, page_num: int) -> List[Dict[str, Any]]:
+        """Tableaux d'une page, avec leurs métadonnées."""
+        # PyMuPDF ne détecte pas nativement les tableaux
+        # On utilise une heuristique basée sur le texte tabulaire
+        tables = self._detect_tables_heuristic(page)
+        
+        return [
+            {
+                "page": page_num + 1,
+                "index": table_index,
+                "rows": len(table_data),
+                "cols": len(table_data[0]) if table_data else 0,
+                "data": table_data
+            }
+            for table_index, table_data in enumerate(tables)
+        ]
+
     def _detect_tables_heuristic(self, page) -> List[List[List[str]]]:
         """
         Détecte les tableaux avec une heuristique simple.
@@ -194,17 +348,31 @@ class MultiModalProcessor:
         """
         logger.info("Starting multimodal processing", pdf_path=pdf_path)
         
-        # Extraire les images
-        images = self.extract_images_from_pdf(pdf_path)
-        
-        # Extraire les tableaux
-        tables = self.extract_tables_from_pdf(pdf_path)
+        # Images et tableaux en un seul passage sur le PDF, par lots de pages :
+        # seul le lot courant garde ses données base64
+        images = []
+        tables = []
+        to_analyze = []
+        try:
+            # Le base64 ne sert qu'à la Vision API : pas d'encodage si elle est désactivée
+            batches = self._process_doc(pdf_path, batch_size=IMAGE_BATCH_PAGES,
+                                        include_base64=self.use_vision_api)
+            for batch, batch_tables in batches:
+                tables.extend(batch_tables)
+                for img in batch:
+                    # Images pour la Vision API si activé (limité pour éviter les coûts) : base64 conservé
+                    if self.use_vision_api and len(to_analyze) < MAX_VISION_IMAGES:
+                        to_analyze.append(img)
+                    else:
+                        img.pop("base64", None)
+                    images.append(img)
+        except Exception as e:
+            logger.error("Multimodal extraction failed", pdf_path=pdf_path, error=str(e))
         
-        # Analyser les images avec Vision API si activé
-        if self.use_vision_api and images:
-            for img in images[:3]:  # Limiter à 3 images pour éviter les coûts
-                description = self.analyze_image_with_vision(img["base64"][:100])  # Placeholder
-                img["ai_description"] = description
+        # Analyser les images retenues, une fois l'extraction terminée
+        for img in to_analyze:
+            img["ai_description"] = self.analyze_image_with_vision(img["base64"][:100])  # Placeholder
+            img.pop("base64", None)
         
         result = {
             "pdf_path": pdf_path,
@@ -239,6 +407,20 @@ class QueryExpander:
             "client": ["consommateur", "acheteur", "utilisateur"],
             "employé": ["salarié", "collaborateur", "personnel", "effectif"]
         }
+        
+        # Une seule alternance compilée (termes les plus longs d'abord) : la requête est parcourue une fois
+        self._pattern = re.compile("|".join(
+            re.escape(term) for term in sorted(self.synonym_dict, key=len, reverse=True)
+        ))
+        max_synonyms = max(len(synonyms) for synonyms in self.synonym_dict.values())
+        self._substitutes = [self._make_substitute(k) for k in range(max_synonyms)]
+
+    def _make_substitute(self, k: int):
+        """Callback de re.sub renvoyant le k-ième synonyme (modulo) du terme trouvé."""
+        def substitute(match):
+            synonyms = self.synonym_dict[match.group(0)]
+            return synonyms[k % len(synonyms)]
+        return substitute
 
     def expand_with_synonyms(self, query: str) -> List[str]:
         """
@@ -250,17 +432,21 @@ class QueryExpander:
         Returns:
             Liste de variations avec synonymes
         """
-        variations = [query]
         query_lower = query.lower()
         
-        for term, synonyms in self.synonym_dict.items():
-            if term in query_lower:
-                for synonym in synonyms:
-                    variation = query_lower.replace(term, synonym)
-                    if variation != query_lower:
-                        variations.append(variation.capitalize())
+        # Cas courant : aucun terme du dictionnaire, on s'arrête au premier balayage
+        if not self._pattern.search(query_lower):
+            return [query]
+        
+        variations = [query]
+        
+        # Variation k : chaque terme trouvé remplacé par son k-ième synonyme, en un seul passage
+        for substitute in self._substitutes:
+            variation = self._pattern.sub(substitute, query_lower)
+            if variation != query_lower:
+                variations.append(variation[:1].upper() + variation[1:])
         
-        return list(set(variations))  # Supprimer les doublons
+        return list(dict.fromkeys(variations))  # Supprimer les doublons en gardant l'ordre
 
 
 # Instances globales
@@ -4,6 +4,7 @@ Collecteur de métriques Prometheus pour monitoring avancé.
 
 from prometheus_client import Counter, Histogram, Gauge, Info, generate_latest, CONTENT_TYPE_LATEST
 from prometheus_client import CollectorRegistry
+from typing import Any, Dict, Iterator, Tuple
 import structlog
 import time
 
@@ -133,30 +134,51 @@ class MetricsMiddleware:
             'Nombre de requêtes en cours',
             registry=registry
         )
+        # Méthodes liées une fois pour toutes : pas de résolution d'attribut par requête
+        self._inc = self.in_progress.inc
+        self._dec = self.in_progress.dec
+        
+        # Séries labellisées résolues une fois par (route, méthode[, statut]) :
+        # chaque requête évite la résolution des labels de prometheus_client
+        self._req_counter_cache: Dict[Tuple[str, str, int], Any] = {}
+        self._dur_hist_cache: Dict[Tuple[str, str], Any] = {}
 
     async def __call__(self, request, call_next):
         """Traite la requête et collecte les métriques."""
         # Incrémenter le compteur de requêtes en cours
-        self.in_progress.inc()
+        self._inc()
         
         start_time = time.time()
         
         try:
             response = await call_next(request)
             
+            # Modèle de route (/sessions/{session_id}) plutôt que le chemin brut : cardinalité bornée.
+            # Les chemins sans route (404, scans) sont regroupés sous "unknown".
+            route = request.scope.get("route")
+            endpoint = getattr(route, "path", None) or "unknown"
+            method = request.method
+            
             # Enregistrer la durée
             duration = time.time() - start_time
-            api_request_duration.labels(
-                endpoint=request.url.path,
-                method=request.method
-            ).observe(duration)
+            key = (endpoint, method)
+            histogram = self._dur_hist_cache.get(key)
+            if histogram is None:
+                histogram = self._dur_hist_cache.setdefault(
+                    key, api_request_duration.labels(endpoint=endpoint, method=method)
+                )
+            histogram.observe(duration)
             
             # Enregistrer le compteur
-            api_requests_total.labels(
-                endpoint=request.url.path,
-                method=request.method,
-                status_code=response.status_code
-            ).inc()
+            counter_key = (endpoint, method, response.status_code)
+            counter = self._req_counter_cache.get(counter_key)
+            if counter is None:
+                counter = self._req_counter_cache.setdefault(
+                    counter_key,
+                    api_requests_total.labels(endpoint=endpoint, method=method,
+                                              status_code=response.status_code)
+                )
+            counter.inc()
             
             return response
             
@@ -170,13 +192,20 @@ class MetricsMiddleware:
             
         finally:
             # Décrémenter le compteur de requêtes en cours
-            self.in_progress.dec()
+            self._dec()
+
+# Séries de rag_response_duration résolues une fois par mode (peu de modes distincts)
+_response_duration_children: Dict[str, Any] = {}
+
 
 def record_question_metrics(mode: str, duration: float, confidence: float, 
                             session_id: str = "default", evaluation_score: float = None):
     """Enregistre les métriques d'une question."""
     rag_questions_total.labels(session_id=session_id, mode=mode).inc()
-    rag_response_duration.labels(mode=mode).observe(duration)
+    histogram = _response_duration_children.get(mode)
+    if histogram is None:
+        histogram = _response_duration_children.setdefault(mode, rag_response_duration.labels(mode=mode))
+    histogram.observe(duration)
     rag_confidence_score.observe(confidence)
     
     if evaluation_score is not None:
@@ -201,6 +230,27 @@ def update_active_sessions_count(count: int):
     """Met à jour le nombre de sessions actives."""
     active_sessions.set(count)
 
+class _SingleFamily:
+    """Collecteur minimal exposant une seule famille déjà collectée (pour generate_latest)."""
+    
+    def __init__(self, family):
+        self.family = family
+    
+    def collect(self):
+        return [self.family]
+
+
+def iter_metrics() -> Iterator[bytes]:
+    """
+    Métriques au format Prometheus, famille par famille.
+    
+    Destiné à une réponse HTTP en streaming : le texte complet du registry
+    n'est jamais assemblé en mémoire.
+    """
+    for family in registry.collect():
+        yield generate_latest(_SingleFamily(family))
+
+
 def get_metrics():
     """Retourne les métriques au format Prometheus."""
     return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -4,12 +4,48 @@ Techniques: Query expansion, Multi-query, HyDE (Hypothetical Document Embeddings
 """
 
 from typing import List, Dict, Any
+from collections import OrderedDict
+import json
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
+import threading
 import structlog
 
 logger = structlog.get_logger(__name__)
 
+# Préfixe d'une ligne de liste numérotée ("1." / "2)" / "-"), retiré avant usage
+_LIST_PREFIX_CHARS = '0123456789.-) '
+
+
+def _list_items(content: str) -> List[str]:
+    """
+    Éléments d'une liste numérotée renvoyée par le LLM, préfixes retirés.
+    
+    Les lignes de 10 caractères ou moins (une fois les blancs retirés) et celles
+    réduites à leur préfixe (séparateurs "-----") sont ignorées.
+    """
+    items = []
+    for line in content.split('\n'):
+        line = line.strip()
+        if len(line) > 10:
+            cleaned = line.lstrip(_LIST_PREFIX_CHARS)
+            if cleaned:
+                items.append(cleaned)
+    return items
+
+
+# Mots vides ignorés par extract_keywords, et ponctuation retirée en un seul appel C
+_STOP_WORDS = frozenset({
+    'le', 'la', 'les', 'un', 'une', 'des', 'de', 'du', 'et',
+    'est', 'sont', 'a', 'au', 'aux', 'dans', 'pour', 'par',
+    'sur', 'avec', 'quel', 'quelle', 'quels', 'quelles', 'comment',
+    'pourquoi', 'qui', 'que', 'quoi'
+})
+_PUNCTUATION_TABLE = str.maketrans({c: None for c in ',.;:!?"\''})
+
+# Réponses LLM conservées par (stratégie, requête normalisée)
+LLM_RESPONSE_CACHE_SIZE = 2048
+
 class QueryOptimizer:
     """Optimiseur de requêtes pour améliorer le retrieval."""
     
@@ -55,8 +91,62 @@ Sous-questions (une par ligne):
 1."""
         )
         
+        # Les trois stratégies en un seul appel, sortie JSON stricte
+        self.combined_prompt = PromptTemplate(
+            input_variables=["query"],
+            template="""Pour la question ci-dessous, produis en une seule fois :
+- "expansions" : 3 variations de la question (synonymes, formulations ou angles complémentaires)
+- "hyde" : un passage hypothétique de document, factuel et détaillé, qui y répondrait parfaitement
+- "sub_questions" : des sous-questions simples et indépendantes qui la décomposent
+
+Question: {query}
+
+Réponds uniquement avec un objet JSON de la forme :
+{{"expansions": ["..."], "hyde": "...", "sub_questions": ["..."]}}"""
+        )
+        
+        self._prompts = {
+            "expansion": self.expansion_prompt,
+            "hyde": self.hyde_prompt,
+            "decomposition": self.decomposition_prompt,
+            "all": self.combined_prompt
+        }
+        
+        # Mode JSON d'OpenAI pour la requête combinée
+        self._json_llm = (
+            self.llm.bind(response_format={"type": "json_object"})
+            if isinstance(self.llm, ChatOpenAI) else self.llm
+        )
+        
+        # LRU des réponses brutes du LLM : une requête répétée ne refait pas d'aller-retour réseau
+        self._response_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
         logger.info("Query optimizer initialized")
 
+    def _invoke(self, strategy: str, query: str) -> str:
+        """Réponse du LLM pour une stratégie, mise en cache sur la requête normalisée."""
+        key = (strategy, " ".join(query.lower().split()))
+        with self._cache_lock:
+            content = self._response_cache.get(key)
+            if content is not None:
+                self._response_cache.move_to_end(key)
+                return content
+        
+        llm = self._json_llm if strategy == "all" else self.llm
+        content = llm.invoke(self._prompts[strategy].format(query=query)).content
+        
+        with self._cache_lock:
+            self._response_cache[key] = content
+            if len(self._response_cache) > LLM_RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+        return content
+
+    def invalidate(self):
+        """Vide le cache des réponses (à appeler après un changement de LLM)."""
+        with self._cache_lock:
+            self._response_cache.clear()
+
     def expand_query(self, query: str) -> List[str]:
         """
         Query Expansion: Génère plusieurs variations de la question.
@@ -68,21 +158,13 @@ Sous-questions (une par ligne):
             Liste de variations incluant la question originale
         """
         try:
-            prompt = self.expansion_prompt.format(query=query)
-            response = self.llm.invoke(prompt)
+            content = self._invoke("expansion", query)
             
             # Parser les variations
             variations = [query]  # Inclure la question originale
             
-            # Extraire les lignes numérotées
-            lines = response.content.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line and len(line) > 10:  # Ignorer les lignes vides ou trop courtes
-                    # Nettoyer les numéros
-                    cleaned = line.lstrip('0123456789.-) ')
-                    if cleaned and cleaned != query:
-                        variations.append(cleaned)
+            # Extraire les lignes numérotées (numéros retirés, lignes trop courtes ignorées)
+            variations += [line for line in _list_items(content) if line != query]
             
             logger.info("Query expansion completed",
                        original=query[:50],
@@ -106,10 +188,7 @@ Sous-questions (une par ligne):
             Document hypothétique
         """
         try:
-            prompt = self.hyde_prompt.format(query=query)
-            response = self.llm.invoke(prompt)
-            
-            hypothetical_doc = response.content.strip()
+            hypothetical_doc = self._invoke("hyde", query).strip()
             
             logger.info("HyDE document generated",
                        query=query[:50],
@@ -132,19 +211,10 @@ Sous-questions (une par ligne):
             Liste de sous-questions
         """
         try:
-            prompt = self.decomposition_prompt.format(query=query)
-            response = self.llm.invoke(prompt)
+            content = self._invoke("decomposition", query)
             
             # Parser les sous-questions
-            sub_questions = []
-            
-            lines = response.content.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line and len(line) > 10:
-                    cleaned = line.lstrip('0123456789.-) ')
-                    if cleaned:
-                        sub_questions.append(cleaned)
+            sub_questions = _list_items(content)
             
             # Si aucune sous-question trouvée, retourner la question originale
             if not sub_questions:
@@ -160,6 +230,34 @@ Sous-questions (une par ligne):
             logger.error("Query decomposition failed", query=query[:50], error=str(e))
             return [query]
 
+    def optimize_all(self, query: str) -> Dict[str, Any]:
+        """
+        Expansion, HyDE et décomposition en un seul aller-retour LLM.
+        
+        Args:
+            query: Question originale
+            
+        Returns:
+            Dictionnaire {"expansion": List[str], "hyde": str, "decomposition": List[str]},
+            aux mêmes formats que les méthodes dédiées
+        """
+        result = json.loads(self._invoke("all", query))
+        
+        expansions = [str(v).strip() for v in result.get("expansions") or []]
+        sub_questions = [str(v).strip() for v in result.get("sub_questions") or []]
+        hypothetical_doc = str(result.get("hyde") or "").strip()
+        
+        logger.info("Combined query optimization completed",
+                   original=query[:50],
+                   variations_count=len(expansions),
+                   sub_questions_count=len(sub_questions))
+        
+        return {
+            "expansion": ([query] + [v for v in expansions if v and v != query])[:4],
+            "hyde": hypothetical_doc or query,
+            "decomposition": [q for q in sub_questions if q] or [query]
+        }
+
     def optimize_query(self, query: str, strategy: str = "expansion") -> Any:
         """
         Optimise une query selon la stratégie choisie.
@@ -171,6 +269,14 @@ Sous-questions (une par ligne):
         Returns:
             Résultat selon la stratégie (List[str] ou str)
         """
+        if strategy in ("expansion", "hyde", "decomposition"):
+            # Un seul appel combiné (mis en cache) sert les trois stratégies
+            try:
+                return self.optimize_all(query)[strategy]
+            except Exception as e:
+                logger.warning("Combined optimization failed, using dedicated prompt",
+                              strategy=strategy, error=str(e))
+        
         if strategy == "expansion":
             return self.expand_query(query)
         elif strategy == "hyde":
@@ -193,13 +299,8 @@ Sous-questions (une par ligne):
             Liste de mots-clés
         """
         # Simple extraction basée sur la longueur et la fréquence
-        stop_words = {'le', 'la', 'les', 'un', 'une', 'des', 'de', 'du', 'et', 
-                     'est', 'sont', 'a', 'au', 'aux', 'dans', 'pour', 'par',
-                     'sur', 'avec', 'quel', 'quelle', 'quels', 'quelles', 'comment',
-                     'pourquoi', 'qui', 'que', 'quoi'}
-        
-        words = query.lower().split()
-        keywords = [w for w in words if len(w) > 3 and w not in stop_words]
+        words = query.translate(_PUNCTUATION_TABLE).lower().split()
+        keywords = [w for w in words if len(w) > 3 and w not in _STOP_WORDS]
         
         return keywords[:5]  # Top 5 keywords
 
@@ -5,16 +5,31 @@ Mesure la qualité des réponses avec des métriques standard de l'industrie.
 
 from typing import Dict, List, Any, Optional
 from dataclasses import dataclass, asdict
+from collections import defaultdict
+import copy
 import json
+import operator
 import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from datetime import datetime
 import structlog
 from pathlib import Path
 
 from app.core.evaluation import RAGEvaluator, EvaluationResult
+from app.core.cache_manager import judge_cache
 
 logger = structlog.get_logger(__name__)
 
+# À incrémenter dès que le calcul des métriques change : invalide les scores déjà en cache
+JUDGE_CACHE_VERSION = 1
+# Durée de vie des scores du juge en cache (s) : un modèle derrière un même nom peut évoluer
+JUDGE_CACHE_TTL = 30 * 86400
+
+# Métriques moyennées dans le résumé d'une évaluation
+SUMMARY_METRICS = ("overall", "relevance", "faithfulness", "context_precision", "context_recall")
+
 @dataclass
 class TestCase:
     """Un cas de test pour l'évaluation RAG."""
@@ -52,6 +67,8 @@ class RAGEvaluationSuite:
         self.evaluator = RAGEvaluator()
         self.test_cases = []
         self.results = []
+        # Dernier résumé calculé : (résultats résumés, total_time, résumé)
+        self._summary_cache = None
         
         if test_cases_file and Path(test_cases_file).exists():
             self.load_test_cases(test_cases_file)
@@ -127,13 +144,21 @@ class RAGEvaluationSuite:
             )
         ]
 
-    def run_evaluation(self, rag_pipeline, test_cases: List[TestCase] = None) -> Dict[str, Any]:
+    def run_evaluation(self, rag_pipeline, test_cases: List[TestCase] = None,
+                       max_workers: int = 8, use_cache: bool = True) -> Dict[str, Any]:
         """
         Exécute l'évaluation complète sur tous les test cases.
         
+        Deux phases : toutes les questions sont d'abord posées au pipeline RAG
+        (en parallèle dans un pool de threads), puis toutes les réponses sont
+        évaluées en une seule passe groupée du juge.
+        
         Args:
             rag_pipeline: Pipeline RAG à évaluer
             test_cases: Liste de test cases (utilise self.test_cases si None)
+            max_workers: Nombre maximum de questions posées simultanément au pipeline
+            use_cache: Réutiliser les scores du juge déjà calculés pour une même
+                       (question, réponse, sources, référence)
             
         Returns:
             Dictionnaire avec les résultats détaillés
@@ -144,14 +169,16 @@ class RAGEvaluationSuite:
         
         start_time = time.time()
         self.results = []
+        self._summary_cache = None
         
-        for i, test_case in enumerate(cases_to_test, 1):
-            logger.info(f"Running test case {i}/{len(cases_to_test)}", 
-                       test_id=test_case.id,
-                       question=test_case.question[:50])
-            
-            result = self._run_single_test(rag_pipeline, test_case)
-            self.results.append(result)
+        # Phase 1 : réponses du pipeline RAG, dans l'ordre des test cases (map conserve l'ordre)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            total = len(cases_to_test)
+            rag_outputs = list(executor.map(self._execute_rag, repeat(rag_pipeline), cases_to_test,
+                                            range(1, total + 1), repeat(total)))
+        
+        # Phase 2 : évaluation groupée de toutes les réponses
+        self.results = self._score_batch(rag_outputs, use_cache)
         
         total_time = time.time() - start_time
         
@@ -170,94 +197,205 @@ class RAGEvaluationSuite:
             "generated_at": datetime.utcnow().isoformat()
         }
 
-    def _run_single_test(self, rag_pipeline, test_case: TestCase) -> TestResult:
-        """Exécute un test case unique."""
+    def _judge_cache_key(self, test_case: TestCase, answer: str, sources: List[Dict]) -> Optional[str]:
+        """
+        Clé de cache des scores du juge : empreinte de tout ce qui influe sur l'évaluation.
+        Retourne None si le juge n'est pas déterministe (température > 0).
+        """
+        llm = self.evaluator.llm_evaluator
+        if llm is not None and (getattr(llm, "temperature", 0) or 0) > 0:
+            return None
+        
+        judge_model = "heuristic"
+        if llm is not None:
+            judge_model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+        
+        payload = {
+            "question": test_case.question,
+            "answer": answer,
+            "sources": sorted(src.get("content", "") for src in sources),
+            "reference_answer": test_case.expected_answer,
+            "judge_model": str(judge_model),
+            "prompts": [self.evaluator.combined_prompt,
+                        self.evaluator.relevance_prompt,
+                        self.evaluator.faithfulness_prompt],
+            "version": JUDGE_CACHE_VERSION
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _execute_rag(self, rag_pipeline, test_case: TestCase,
+                     position: int = 1, total: int = 1) -> Dict[str, Any]:
+        """Pose la question d'un test case au pipeline RAG, sans l'évaluer."""
+        # Journalisé au démarrage effectif dans le pool, pas à la soumission
+        logger.info(f"Running test case {position}/{total}",
+                   test_id=test_case.id,
+                   question=test_case.question[:50])
         test_start = time.time()
         
         try:
-            # Poser la question au système RAG
             result = rag_pipeline.ask_question(test_case.question, save_conversation=False)
             
-            answer = result["answer"]
-            sources = result.get("sources", [])
-            response_time = time.time() - test_start
+            return {
+                "test_case": test_case,
+                "answer": result["answer"],
+                "sources": result.get("sources", []),
+                "response_time": time.time() - test_start,
+                "error": None
+            }
             
-            # Évaluer la réponse
-            eval_result = self.evaluator.evaluate_response(
-                question=test_case.question,
-                answer=answer,
-                sources=sources,
-                reference_answer=test_case.expected_answer
-            )
+        except Exception as e:
+            logger.error("Test execution failed",
+                        test_id=test_case.id,
+                        error=str(e))
+            
+            return {
+                "test_case": test_case,
+                "answer": "",
+                "sources": [],
+                "response_time": time.time() - test_start,
+                "error": str(e)
+            }
+
+    def _score_batch(self, rag_outputs: List[Dict[str, Any]], use_cache: bool = False) -> List[TestResult]:
+        """
+        Évalue un lot de réponses RAG : les scores déjà en cache sont réutilisés,
+        les autres sont calculés en un seul appel groupé à l'évaluateur.
+        """
+        scores = [None] * len(rag_outputs)
+        cache_keys = [None] * len(rag_outputs)
+        to_evaluate = []
+        
+        for i, output in enumerate(rag_outputs):
+            if output["error"]:
+                continue
             
-            # Déterminer si le test passe
-            # Un test passe si le score global est > 0.6
-            passed = eval_result.overall_score >= 0.6
+            if use_cache:
+                cache_keys[i] = self._judge_cache_key(output["test_case"], output["answer"], output["sources"])
+                cached = judge_cache.get(cache_keys[i]) if cache_keys[i] is not None else None
+                if cached is not None:
+                    logger.debug("Judge cache hit", test_id=output["test_case"].id, key=cache_keys[i][:8])
+                    scores[i] = cached
+                    continue
             
-            return TestResult(
-                test_case_id=test_case.id,
-                question=test_case.question,
-                answer=answer,
-                expected_answer=test_case.expected_answer,
-                evaluation_scores={
+            to_evaluate.append(i)
+        
+        if to_evaluate:
+            eval_results = self.evaluator.evaluate_batch([
+                {
+                    "question": rag_outputs[i]["test_case"].question,
+                    "answer": rag_outputs[i]["answer"],
+                    "sources": rag_outputs[i]["sources"],
+                    "reference_answer": rag_outputs[i]["test_case"].expected_answer
+                }
+                for i in to_evaluate
+            ])
+            
+            for i, eval_result in zip(to_evaluate, eval_results):
+                scores[i] = {
                     "overall": eval_result.overall_score,
                     "relevance": eval_result.relevance_score,
                     "faithfulness": eval_result.faithfulness_score,
                     "context_precision": eval_result.context_precision,
                     "context_recall": eval_result.context_recall
-                },
-                passed=passed,
-                response_time=response_time,
-                timestamp=datetime.utcnow().isoformat()
-            )
-            
-        except Exception as e:
-            logger.error("Test execution failed",
-                        test_id=test_case.id,
-                        error=str(e))
-            
-            return TestResult(
+                }
+                # Un score obtenu par repli (juge indisponible, réponse illisible) n'est pas mis en cache :
+                # le prochain run redemandera le juge au lieu de réutiliser une valeur dégradée
+                if cache_keys[i] is not None and not eval_result.degraded:
+                    judge_cache.set(cache_keys[i], scores[i], expire=JUDGE_CACHE_TTL)
+        
+        results = []
+        for output, evaluation_scores in zip(rag_outputs, scores):
+            test_case = output["test_case"]
+            results.append(TestResult(
                 test_case_id=test_case.id,
                 question=test_case.question,
-                answer="",
+                answer=output["answer"],
                 expected_answer=test_case.expected_answer,
-                evaluation_scores={},
-                passed=False,
-                error=str(e),
-                response_time=time.time() - test_start,
+                evaluation_scores=evaluation_scores or {},
+                # Un test passe si le score global est >= 0.6
+                passed=evaluation_scores is not None and evaluation_scores["overall"] >= 0.6,
+                error=output["error"],
+                response_time=output["response_time"],
                 timestamp=datetime.utcnow().isoformat()
-            )
+            ))
+        
+        return results
+
+    def _run_single_test(self, rag_pipeline, test_case: TestCase, use_cache: bool = False) -> TestResult:
+        """Exécute un test case unique."""
+        return self._score_batch([self._execute_rag(rag_pipeline, test_case)], use_cache)[0]
 
     def _generate_summary(self, total_time: float) -> Dict[str, Any]:
-        """Génère un résumé des résultats."""
+        """
+        Génère un résumé des résultats.
+        
+        Le résumé est mémoïsé tant que self.results contient les mêmes objets TestResult,
+        dans le même ordre : les rapports HTML/JSON et la comparaison à la baseline ne le
+        recalculent pas. Chaque appel renvoie une copie, modifiable sans effet sur le cache.
+        """
         if not self.results:
             return {}
         
-        passed_results = [r for r in self.results if r.passed]
-        failed_results = [r for r in self.results if not r.passed]
+        cached = self._summary_cache
+        if (cached is not None and cached[1] == total_time
+                and len(cached[0]) == len(self.results)
+                and all(map(operator.is_, cached[0], self.results))):
+            return copy.deepcopy(cached[2])
         
-        # Scores moyens
-        all_scores = [r.evaluation_scores for r in self.results if r.evaluation_scores]
+        summary = self._compute_summary(total_time)
+        # Les résultats eux-mêmes sont retenus (et non leurs id) : un identifiant ne peut pas être réutilisé
+        self._summary_cache = (tuple(self.results), total_time, summary)
+        return copy.deepcopy(summary)
+
+    def _compute_summary(self, total_time: float) -> Dict[str, Any]:
+        """Calcule le résumé de self.results (non vide)."""
+        # Une seule passe sur les résultats : compteurs, sommes par métrique et temps de réponse
+        passed_count = 0
+        failed_test_ids = []
+        metric_sums = defaultdict(float)
+        metric_counts = defaultdict(int)
+        has_scores = False
+        response_time_sum = 0.0
+        response_time_count = 0
+        
+        for r in self.results:
+            if r.passed:
+                passed_count += 1
+            else:
+                failed_test_ids.append(r.test_case_id)
+            
+            scores = r.evaluation_scores
+            if scores:
+                has_scores = True
+                # Seules les métriques du résumé sont accumulées, quelles que soient les autres clés
+                for key in SUMMARY_METRICS:
+                    score = scores.get(key)
+                    if score is not None:
+                        metric_sums[key] += score
+                        metric_counts[key] += 1
+            
+            if r.response_time:
+                response_time_sum += r.response_time
+                response_time_count += 1
         
+        # Scores moyens
         avg_scores = {}
-        if all_scores:
-            for key in ["overall", "relevance", "faithfulness", "context_precision", "context_recall"]:
-                scores = [s.get(key, 0) for s in all_scores if key in s]
-                avg_scores[key] = sum(scores) / len(scores) if scores else 0
+        if has_scores:
+            for key in SUMMARY_METRICS:
+                avg_scores[key] = metric_sums[key] / metric_counts[key] if metric_counts[key] else 0
         
         # Temps de réponse
-        response_times = [r.response_time for r in self.results if r.response_time]
-        avg_response_time = sum(response_times) / len(response_times) if response_times else 0
+        avg_response_time = response_time_sum / response_time_count if response_time_count else 0
         
         return {
             "total_tests": len(self.results),
-            "passed_count": len(passed_results),
-            "failed_count": len(failed_results),
-            "pass_rate": len(passed_results) / len(self.results) if self.results else 0,
+            "passed_count": passed_count,
+            "failed_count": len(failed_test_ids),
+            "pass_rate": passed_count / len(self.results),
             "average_scores": avg_scores,
             "avg_response_time": avg_response_time,
             "total_evaluation_time": total_time,
-            "failed_test_ids": [r.test_case_id for r in failed_results]
+            "failed_test_ids": failed_test_ids
         }
 
     def generate_html_report(self, output_file: str = "evaluation_report.html"):
@@ -334,40 +472,16 @@ class RAGEvaluationSuite:
 </html>
 """
         
-        # Générer le HTML des résultats
-        test_results_html = ""
-        for result in self.results:
-            status_class = "passed" if result.passed else "failed"
-            status_icon = "✅" if result.passed else "❌"
-            
-            scores_html = ""
-            if result.evaluation_scores:
-                for metric, score in result.evaluation_scores.items():
-                    score_class = self._get_score_class_name(score)
-                    scores_html += f'<span class="score-badge {score_class}">{metric}: {score:.2f}</span>'
-            
-            test_results_html += f"""
-            <div class="test-result {status_class}">
-                <h3>{status_icon} Test {result.test_case_id}</h3>
-                <p><strong>Question:</strong> {result.question}</p>
-                <p><strong>Réponse:</strong> {result.answer[:300]}...</p>
-                {f'<p><strong>Réponse attendue:</strong> {result.expected_answer}</p>' if result.expected_answer else ''}
-                <div class="scores">{scores_html}</div>
-                <p><em>Temps de réponse: {result.response_time:.2f}s</em></p>
-                {f'<p style="color: #f56565;"><strong>Erreur:</strong> {result.error}</p>' if result.error else ''}
-            </div>
-            """
-        
-        # Remplir le template
-        html_content = html_template.format(
+        # En-tête rempli avec le résumé ; les résultats sont écrits un par un entre en-tête et pied de page
+        header_template, footer = html_template.split("{test_results_html}")
+        header = header_template.format(
             generated_at=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
             total_tests=summary["total_tests"],
             passed=summary["passed_count"],
             failed=summary["failed_count"],
             pass_rate=summary["pass_rate"],
             avg_score=summary["average_scores"].get("overall", 0),
-            avg_time=summary["avg_response_time"],
-            test_results_html=test_results_html
+            avg_time=summary["avg_response_time"]
         )
         
         # Sauvegarder le rapport
@@ -375,11 +489,36 @@ class RAGEvaluationSuite:
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
         with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            f.write(header)
+            # Rendu paresseux : un seul bloc de résultat en mémoire à la fois
+            f.writelines(map(self._render_result_html, self.results))
+            f.write(footer)
         
         logger.info("HTML report generated", filepath=str(output_path))
         return str(output_path)
 
+    def _render_result_html(self, result: TestResult) -> str:
+        """Bloc HTML d'un résultat de test pour le rapport."""
+        status_class = "passed" if result.passed else "failed"
+        status_icon = "✅" if result.passed else "❌"
+        
+        scores_html = "".join(
+            f'<span class="score-badge {self._get_score_class_name(score)}">{metric}: {score:.2f}</span>'
+            for metric, score in (result.evaluation_scores or {}).items()
+        )
+        
+        return f"""
+            <div class="test-result {status_class}">
+                <h3>{status_icon} Test {result.test_case_id}</h3>
+                <p><strong>Question:</strong> {result.question}</p>
+                <p><strong>Réponse:</strong> {result.answer[:300]}...</p>
+                {f'<p><strong>Réponse attendue:</strong> {result.expected_answer}</p>' if result.expected_answer else ''}
+                <div class="scores">{scores_html}</div>
+                <p><em>Temps de réponse: {result.response_time:.2f}s</em></p>
+                {f'<p style="color: #f56565;"><strong>Erreur:</strong> {result.error}</p>' if result.error else ''}
+            </div>
+            """
+
     def _get_score_class_name(self, score: float) -> str:
         """Retourne le nom de la classe CSS selon le score."""
         if score >= 0.8:
@@ -392,36 +531,43 @@ class RAGEvaluationSuite:
             return "score-poor"
 
     def export_results_json(self, output_file: str = "evaluation_results.json"):
-        """Exporte les résultats en JSON."""
-        summary = self._generate_summary(0)
+        """
+        Exporte les résultats en JSON.
         
-        data = {
-            "summary": summary,
-            "test_results": [asdict(r) for r in self.results],
-            "generated_at": datetime.utcnow().isoformat()
-        }
+        Les résultats sont écrits un par un dans le fichier (un objet par ligne),
+        sans construire au préalable une copie complète de la liste.
+        """
+        summary = self._generate_summary(0)
         
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.write('{\n  "summary": ')
+            json.dump(summary, f, ensure_ascii=False)
+            f.write(',\n  "generated_at": ')
+            json.dump(datetime.utcnow().isoformat(), f)
+            f.write(',\n  "test_results": [')
+            for i, result in enumerate(self.results):
+                f.write(",\n    " if i else "\n    ")
+                # Champs du dataclass lus directement : asdict() en ferait une copie profonde
+                json.dump(vars(result), f, ensure_ascii=False)
+            f.write("\n  ]\n}\n")
         
         logger.info("JSON results exported", filepath=output_file)
         return output_file
 
     def get_results_by_category(self) -> Dict[str, List[TestResult]]:
         """Regroupe les résultats par catégorie."""
-        categories = {}
+        categories = defaultdict(list)
+        
+        # Index construit à chaque appel : self.test_cases peut être réassigné entre deux évaluations
+        test_cases_by_id = {tc.id: tc for tc in self.test_cases}
         
         for result in self.results:
-            # Trouver le test case correspondant
-            test_case = next((tc for tc in self.test_cases if tc.id == result.test_case_id), None)
+            test_case = test_cases_by_id.get(result.test_case_id)
             
             if test_case:
-                category = test_case.category
-                if category not in categories:
-                    categories[category] = []
-                categories[category].append(result)
+                categories[test_case.category].append(result)
         
-        return categories
+        return dict(categories)
 
     def get_failed_tests_analysis(self) -> Dict[str, Any]:
         """Analyse les tests échoués pour identifier les patterns."""
@@ -1,4 +1,9 @@
 import os
+import hashlib
+import pickle
+import uuid
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from langchain_community.vectorstores import Chroma
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -12,18 +17,45 @@ load_dotenv()
 # Constantes pour la configuration
 CHROMA_DB_PATH = "./chroma_db"
 PDF_STORAGE_PATH = "./pdf_storage"
+PDF_CHUNKS_CACHE_PATH = "./cache/pdf_chunks"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_MAX_WORKERS = 8
+
+def _pdf_cache_key(pdf_path: str) -> str:
+    """Empreinte du contenu du PDF et des paramètres de découpage."""
+    hasher = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    hasher.update(f"{CHUNK_SIZE}:{CHUNK_OVERLAP}".encode())
+    return hasher.hexdigest()
 
 def load_and_process_pdf(pdf_path: str) -> list:
     """
     Charge un fichier PDF, le divise en chunks et retourne les documents.
+    Les chunks sont mis en cache sur disque : un PDF inchangé n'est ni relu ni redécoupé.
     """
+    cache_path = Path(PDF_CHUNKS_CACHE_PATH) / f"{_pdf_cache_key(pdf_path)}.pkl"
+    if cache_path.exists():
+        split_docs = pickle.loads(cache_path.read_bytes())
+        print(f"Chunks chargés depuis le cache : {len(split_docs)} chunks.")
+        return split_docs
+
     print(f"Chargement du document : {pdf_path}")
     loader = PyPDFLoader(pdf_path)
     documents = loader.load()
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
     split_docs = text_splitter.split_documents(documents)
     print(f"Document divisé en {len(split_docs)} chunks.")
+
+    # Écriture atomique : un fichier à moitié écrit ne doit jamais être relu comme cache
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    tmp_path.write_bytes(pickle.dumps(split_docs, protocol=pickle.HIGHEST_PROTOCOL))
+    os.replace(tmp_path, cache_path)
     return split_docs
 
 def create_or_get_vectorstore(documents: list = None, force_recreate: bool = False):
@@ -31,18 +63,34 @@ def create_or_get_vectorstore(documents: list = None, force_recreate: bool = Fal
     Crée une base de données vectorielle Chroma à partir des documents
     ou charge une base existante si elle est présente sur le disque.
     """
-    embeddings = OpenAIEmbeddings()
+    embeddings = OpenAIEmbeddings(chunk_size=EMBEDDING_BATCH_SIZE, max_retries=6)
     
     if os.path.exists(CHROMA_DB_PATH) and not force_recreate:
         print(f"Chargement de la base de données vectorielle depuis : {CHROMA_DB_PATH}")
         vectorstore = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
     elif documents:
         print("Création d'une nouvelle base de données vectorielle...")
-        vectorstore = Chroma.from_documents(
-            documents=documents, 
-            embedding=embeddings,
-            persist_directory=CHROMA_DB_PATH
-        )
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        
+        # Embeddings calculés en amont, plusieurs batchs en vol à la fois
+        batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS) as executor:
+            vectors = [vector for batch in executor.map(embeddings.embed_documents, batches) for vector in batch]
+        
+        # Écriture directe dans la collection (Chroma ne recalcule pas les embeddings),
+        # par lots de la taille maximale acceptée par le client
+        vectorstore = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
+        ids = [str(uuid.uuid4()) for _ in texts]
+        max_batch = vectorstore._client.get_max_batch_size()
+        for start in range(0, len(ids), max_batch):
+            end = start + max_batch
+            vectorstore._collection.add(
+                ids=ids[start:end],
+                embeddings=vectors[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
         print("Base de données vectorielle créée et sauvegardée.")
     else:
         raise ValueError("Aucun document fourni et aucune base de données existante à charger.")
@@ -6,12 +6,16 @@ from typing import Optional
 from datetime import datetime
 import math
 import re
+import asyncio
 import requests
 import json
 import structlog
 
 logger = structlog.get_logger(__name__)
 
+# Session HTTP partagée : connexions keep-alive réutilisées entre les recherches
+_http_session = requests.Session()
+
 class CalculatorTool:
     """Outil de calcul mathématique avancé."""
     
@@ -97,12 +101,17 @@ Pour votre question "{query}", voici des informations générales :
 
 *Les outils de calcul, date et analyse de texte fonctionnent sans connexion internet.*"""
     
+    @staticmethod
+    async def arun(query: str, max_results: int = 3) -> str:
+        """Version asynchrone : la requête HTTP bloquante s'exécute dans un thread."""
+        return await asyncio.to_thread(WebSearchTool.run, query, max_results)
+    
     @staticmethod
     def _get_bitcoin_price() -> str:
         """Récupère le prix du Bitcoin en temps réel."""
         try:
             # Utiliser l'API CoinGecko (gratuite, pas de clé requise)
-            response = requests.get(
+            response = _http_session.get(
                 "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd,eur&include_24hr_change=true",
                 timeout=10
             )
@@ -158,7 +167,7 @@ Pour votre question "{query}", voici des informations générales :
             if not crypto_id:
                 return "Crypto-monnaie non reconnue. Essayez : Bitcoin, Ethereum, Cardano, Solana, etc."
             
-            response = requests.get(
+            response = _http_session.get(
                 f"https://api.coingecko.com/api/v3/simple/price?ids={crypto_id}&vs_currencies=usd,eur&include_24hr_change=true",
                 timeout=10
             )
@@ -202,7 +211,7 @@ Pour votre question "{query}", voici des informations générales :
             
             # Pour les recherches générales, utiliser une API de news
             if any(word in query.lower() for word in ['actualité', 'news', 'nouvelle', 'dernière']):
-                response = requests.get(
+                response = _http_session.get(
                     f"https://newsapi.org/v2/everything?q={query}&sortBy=publishedAt&pageSize={max_results}",
                     headers=headers,
                     timeout=10
@@ -303,6 +312,10 @@ class DocumentQueryTool:
         except Exception as e:
             logger.error("Document query error", query=query[:50], error=str(e))
             return f"Erreur lors de la recherche dans les documents : {str(e)}"
+    
+    async def arun(self, query: str) -> str:
+        """Version asynchrone : l'appel RAG bloquant s'exécute dans un thread."""
+        return await asyncio.to_thread(self.run, query)
 
 
 class TextAnalysisTool:
@@ -20,8 +20,9 @@ from app.core.report_generator import report_generator
 from app.core.agents import RAGAgent, create_agent
 from app.core.rag_evaluation_suite import evaluation_suite
 from app.core.prometheus_metrics import (
-    get_metrics, record_question_metrics, record_document_metrics,
-    record_agent_metrics, record_error, update_active_sessions_count
+    iter_metrics, record_question_metrics, record_document_metrics,
+    record_agent_metrics, record_error, update_active_sessions_count,
+    CONTENT_TYPE_LATEST, MetricsMiddleware
 )
 
 # Configuration du logger structuré
@@ -88,6 +89,7 @@ class AskResponse(BaseModel):
     agent_used: bool = False
     reasoning_steps: List[Dict[str, Any]] = []
     tools_used: List[str] = []
+    cache_hit: bool = False
 
 class SessionSummaryResponse(BaseModel):
     session_id: str
@@ -243,6 +245,65 @@ async def upload_document_to_session(
         if os.path.exists(file_path):
             os.remove(file_path)
 
+@app.post("/sessions/{session_id}/upload-batch", summary="Ajouter plusieurs documents à une session")
+async def upload_documents_to_session(
+    session_id: str,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Ajoute plusieurs documents PDF à une session existante : découpage en parallèle
+    puis un seul passage d'embedding pour l'ensemble des chunks.
+    """
+    global current_pipeline
+    
+    for file in files:
+        if not file.filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail=f"Seuls les fichiers PDF sont autorisés : {file.filename}")
+
+    # Vérifier que la session existe
+    session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session non trouvée.")
+
+    saved_files = []
+    try:
+        # Sauvegarder les fichiers
+        for file in files:
+            file_path = f"./pdf_storage/{uuid.uuid4()}_{file.filename}"
+            with open(file_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+            saved_files.append((file_path, file.filename))
+        
+        # Initialiser ou récupérer le pipeline pour cette session
+        if not current_pipeline or current_pipeline.session_id != session_id:
+            current_pipeline = AdvancedRAGPipeline(session_id)
+            current_pipeline.load_session_documents()
+        
+        # Traiter les documents
+        result = current_pipeline.process_documents(saved_files)
+        
+        # Enregistrer les métriques
+        for document in result["documents"]:
+            global_metrics.record_document(document["chunks_count"])
+        
+        logger.info("Documents uploaded successfully",
+                   files_count=len(result["documents"]),
+                   session_id=session_id,
+                   chunks_count=result["chunks_count"])
+        
+        return result
+
+    except Exception as e:
+        logger.error("Batch document upload failed", filenames=[f.filename for f in files], error=str(e))
+        global_metrics.record_question(0, 0, error=True)
+        raise HTTPException(status_code=500, detail=f"Erreur lors du traitement : {e}")
+    finally:
+        # Nettoyer les fichiers temporaires
+        for file_path, _ in saved_files:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
 @app.post("/ask", response_model=AskResponse, summary="Poser une question intelligente")
 async def ask_question_advanced(request: AskRequest, db: Session = Depends(get_db)):
     """
@@ -293,7 +354,7 @@ async def ask_question_advanced(request: AskRequest, db: Session = Depends(get_d
                 current_agent = create_agent("react", rag_pipeline=current_pipeline)
             
             # Exécuter l'agent
-            agent_result = current_agent.run(request.question, session_id)
+            agent_result = await current_agent.arun(request.question, session_id)
             
             # Structurer la réponse pour être compatible avec AskResponse
             result = {
@@ -355,7 +416,8 @@ async def ask_question_advanced(request: AskRequest, db: Session = Depends(get_d
             model_used="gpt-3.5-turbo",
             agent_used=result.get("agent_used", False),
             reasoning_steps=result.get("reasoning_steps", []),
-            tools_used=result.get("tools_used", [])
+            tools_used=result.get("tools_used", []),
+            cache_hit=result.get("cache_hit", False)
         )
 
     except Exception as e:
@@ -447,29 +509,6 @@ async def ask_question_stream(request: AskRequest, db: Session = Depends(get_db)
     async def generate_stream() -> AsyncGenerator[str, None]:
         """Génère le stream de tokens."""
         try:
-            # Import ici pour éviter les problèmes circulaires
-            from langchain.callbacks.base import BaseCallbackHandler
-            from langchain_openai import ChatOpenAI
-            
-            class StreamingCallbackHandler(BaseCallbackHandler):
-                """Callback pour capturer les tokens streamés."""
-                def __init__(self):
-                    self.tokens = []
-                
-                def on_llm_new_token(self, token: str, **kwargs):
-                    self.tokens.append(token)
-            
-            # Créer le callback
-            callback = StreamingCallbackHandler()
-            
-            # Créer un LLM avec streaming
-            streaming_llm = ChatOpenAI(
-                model_name="gpt-3.5-turbo",
-                temperature=0,
-                streaming=True,
-                callbacks=[callback]
-            )
-            
             # Envoyer un événement de démarrage
             yield f"data: {json.dumps({'type': 'start', 'session_id': session_id})}\n\n"
             
@@ -478,7 +517,7 @@ async def ask_question_stream(request: AskRequest, db: Session = Depends(get_db)
                 if not current_agent:
                     current_agent = create_agent("react", rag_pipeline=current_pipeline)
                 
-                result = current_agent.run(request.question, session_id)
+                result = await current_agent.arun(request.question, session_id)
                 
                 # Simuler le streaming en envoyant par mots
                 words = result["answer"].split()
@@ -490,19 +529,13 @@ async def ask_question_stream(request: AskRequest, db: Session = Depends(get_db)
                 yield f"data: {json.dumps({'type': 'metadata', 'reasoning_steps': result.get('reasoning_steps', []), 'tools_used': result.get('tools_used', [])})}\n\n"
             
             else:
-                # Mode RAG avec vrai streaming
-                # Note: RetrievalQA ne supporte pas nativement le streaming,
-                # on simule en envoyant la réponse par mots
-                result = current_pipeline.ask_question(request.question)
-                
-                words = result["answer"].split()
-                for word in words:
-                    yield f"data: {json.dumps({'type': 'token', 'content': word + ' '})}\n\n"
-                    await asyncio.sleep(0.05)
-                
-                # Envoyer les sources
-                if result.get("sources"):
-                    yield f"data: {json.dumps({'type': 'sources', 'sources': result['sources'][:3]})}\n\n"
+                # Mode RAG : tokens transmis au fil de la génération du LLM
+                async for event in current_pipeline.astream_question(request.question):
+                    if event["type"] == "sources":
+                        if event["sources"]:
+                            yield f"data: {json.dumps({'type': 'sources', 'sources': event['sources'][:3]})}\n\n"
+                    else:
+                        yield f"data: {json.dumps(event)}\n\n"
             
             # Événement de fin
             yield f"data: {json.dumps({'type': 'done', 'session_id': session_id})}\n\n"
@@ -540,10 +573,12 @@ async def get_agent_tools():
 # Endpoints pour l'évaluation et les tests
 
 @app.post("/evaluation/run", summary="Exécuter la suite de tests d'évaluation")
-async def run_evaluation_suite(session_id: str):
+async def run_evaluation_suite(session_id: str, use_cache: bool = True):
     """
     Exécute la suite complète de tests d'évaluation sur une session.
     Génère un rapport HTML avec les résultats.
+    
+    `use_cache=false` force le juge à réévaluer toutes les réponses.
     """
     try:
         # Charger le pipeline de la session
@@ -555,7 +590,7 @@ async def run_evaluation_suite(session_id: str):
         
         # Exécuter l'évaluation
         logger.info("Starting evaluation suite", session_id=session_id)
-        results = evaluation_suite.run_evaluation(pipeline)
+        results = evaluation_suite.run_evaluation(pipeline, use_cache=use_cache)
         
         # Générer le rapport HTML
         html_file = f"reports/evaluation_{session_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.html"
@@ -597,10 +632,8 @@ async def get_evaluation_results():
 @app.get("/metrics/prometheus", summary="Métriques Prometheus")
 async def prometheus_metrics():
     """Endpoint pour exposer les métriques au format Prometheus."""
-    from fastapi import Response
-    
-    metrics, content_type = get_metrics()
-    return Response(content=metrics, media_type=content_type)
+    # Familles écrites au fil de l'eau (générateur synchrone exécuté dans le threadpool)
+    return StreamingResponse(iter_metrics(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health", summary="Vérification de l'état du système")
 async def health_check():
@@ -815,6 +848,9 @@ async def request_logging_middleware(request: Request, call_next):
     
     return response
 
+# Métriques Prometheus par route (durée, statut, requêtes en cours)
+app.middleware("http")(MetricsMiddleware())
+
 # Endpoints de sécurité et monitoring
 
 @app.get("/security/info", summary="Informations de sécurité")
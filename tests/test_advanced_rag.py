@@ -0,0 +1,115 @@
+"""
+Tests pour la détection des succès du cache LLM et le retriever à compression adaptative.
+"""
+
+from typing import List
+
+from langchain_core.caches import InMemoryCache
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from app.core.advanced_rag import AdaptiveCompressionRetriever, HitTrackingCache, _LLM_CACHE_STATS
+
+
+class TestHitTrackingCache:
+    """Tests pour HitTrackingCache (délégation et comptage)."""
+
+    def setup_method(self):
+        """Configuration avant chaque test : compteurs actifs comme dans ask_question."""
+        self.stats = {"lookups": 0, "hits": 0}
+        self.token = _LLM_CACHE_STATS.set(self.stats)
+
+    def teardown_method(self):
+        """Nettoyage après chaque test."""
+        _LLM_CACHE_STATS.reset(self.token)
+
+    def test_counts_lookups_and_hits(self):
+        """Un échec puis un succès sont comptés, la valeur du cache sous-jacent est renvoyée."""
+        cache = HitTrackingCache(InMemoryCache())
+
+        assert cache.lookup("prompt", "llm") is None
+        cache.update("prompt", "llm", ["generation"])
+        assert cache.lookup("prompt", "llm") == ["generation"]
+
+        assert self.stats == {"lookups": 2, "hits": 1}
+
+    def test_no_stats_outside_question(self):
+        """Hors d'une question (aucun compteur actif), le cache délègue sans compter."""
+        cache = HitTrackingCache(InMemoryCache())
+        cache.update("prompt", "llm", ["generation"])
+
+        _LLM_CACHE_STATS.set(None)
+        assert cache.lookup("prompt", "llm") == ["generation"]
+
+    def test_chat_model_cache_hit(self):
+        """Via un modèle de chat, seule la deuxième invocation identique est un succès."""
+        llm = FakeListChatModel(responses=["première", "seconde"],
+                                cache=HitTrackingCache(InMemoryCache()))
+
+        first = llm.invoke("Quel est le CA ?")
+        assert self.stats == {"lookups": 1, "hits": 0}
+
+        second = llm.invoke("Quel est le CA ?")
+        assert self.stats == {"lookups": 2, "hits": 1}
+        assert second.content == first.content
+
+    def test_clear_delegates(self):
+        """clear vide le cache sous-jacent."""
+        underlying = InMemoryCache()
+        cache = HitTrackingCache(underlying)
+        cache.update("prompt", "llm", ["generation"])
+
+        cache.clear()
+
+        assert underlying.lookup("prompt", "llm") is None
+
+
+class _ListRetriever(BaseRetriever):
+    """Retriever renvoyant toujours la même liste de documents."""
+    
+    docs: List[Document]
+    
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.docs
+
+
+class _CountingCompressor(BaseDocumentCompressor):
+    """Compresseur gardant le premier document et comptant ses appels."""
+    
+    calls: int = 0
+    
+    def compress_documents(self, documents, query, callbacks=None):
+        self.calls += 1
+        return documents[:1]
+
+
+class TestAdaptiveCompressionRetriever:
+    """Tests pour le court-circuit du reranker selon le nombre de documents trouvés."""
+
+    def _retriever(self, docs_count: int) -> AdaptiveCompressionRetriever:
+        docs = [Document(page_content=f"chunk {i}") for i in range(docs_count)]
+        return AdaptiveCompressionRetriever(
+            base_compressor=_CountingCompressor(),
+            base_retriever=_ListRetriever(docs=docs),
+            threshold=5
+        )
+
+    def test_few_documents_skip_compressor(self):
+        """Au plus `threshold` documents : renvoyés tels quels, sans appeler le compresseur."""
+        retriever = self._retriever(4)
+
+        docs = retriever.invoke("question")
+
+        assert len(docs) == 4
+        assert retriever.base_compressor.calls == 0
+
+    def test_many_documents_compressed(self):
+        """Au-delà de `threshold` documents, le compresseur (reranker) fait le tri."""
+        retriever = self._retriever(10)
+
+        docs = retriever.invoke("question")
+
+        assert [doc.page_content for doc in docs] == ["chunk 0"]
+        assert retriever.base_compressor.calls == 1
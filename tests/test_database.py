@@ -0,0 +1,44 @@
+"""
+Tests pour les identifiants de clé primaire (UUIDv7).
+"""
+
+import time
+import uuid
+
+from app.core.database import _uuid7, new_id
+
+
+class TestUUIDv7:
+    """Tests pour la génération d'identifiants ordonnés dans le temps."""
+
+    def test_version_and_variant(self):
+        """Les bits de version (7) et de variante (RFC) sont positionnés."""
+        value = _uuid7()
+
+        assert value.version == 7
+        assert value.variant == uuid.RFC_4122
+
+    def test_timestamp_prefix(self):
+        """Les 48 premiers bits contiennent l'horodatage en millisecondes."""
+        before = time.time_ns() // 1_000_000
+        value = _uuid7()
+        after = time.time_ns() // 1_000_000
+
+        assert before <= value.int >> 80 <= after
+
+    def test_random_bits_differ(self):
+        """Deux identifiants générés dans la même milliseconde restent distincts."""
+        ids = {_uuid7() for _ in range(1000)}
+
+        assert len(ids) == 1000
+
+    def test_new_id_is_time_ordered(self):
+        """Des identifiants générés à des millisecondes différentes sont triés par date."""
+        ids = []
+        for _ in range(5):
+            ids.append(new_id())
+            time.sleep(0.002)
+
+        assert all(isinstance(i, str) for i in ids)
+        assert [uuid.UUID(i).version for i in ids] == [7] * 5
+        assert ids == sorted(ids)
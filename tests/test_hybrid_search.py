@@ -0,0 +1,131 @@
+"""
+Tests pour la recherche hybride (index BM25 et fusion des classements).
+"""
+
+import pytest
+import numpy as np
+import xxhash
+from unittest.mock import Mock
+from langchain.schema import Document
+from rank_bm25 import BM25Okapi
+
+from app.core.hybrid_search import BM25Index, HybridRetriever, RRF_CANDIDATES, _tokenize
+
+
+CORPUS = [
+    "Le chiffre d'affaires de l'entreprise atteint 100 millions d'euros en 2023.",
+    "Les risques principaux sont le change, le crédit et la concurrence.",
+    "La stratégie prévoit une expansion internationale sur trois ans.",
+    "Le chiffre d'affaires 2022 était inférieur au chiffre d'affaires 2023.",
+    "Partenariats internationaux : Allemagne, Japon et Brésil.",
+    "",
+]
+
+
+class TestBM25Index:
+    """Tests pour l'index BM25 vectorisé."""
+
+    def setup_method(self):
+        """Configuration avant chaque test."""
+        self.tokenized = [_tokenize(text) for text in CORPUS]
+        self.index = BM25Index(self.tokenized)
+
+    @pytest.mark.parametrize("query", [
+        "chiffre d'affaires 2023",
+        "risques crédit",
+        "stratégie internationale expansion",
+        "le la",
+        "terme absent du corpus",
+        "",
+    ])
+    def test_scores_match_rank_bm25(self, query):
+        """Les scores sont identiques à ceux de rank_bm25.BM25Okapi."""
+        reference = BM25Okapi(self.tokenized)
+
+        expected = reference.get_scores(_tokenize(query))
+        scores = self.index.get_scores(_tokenize(query))
+
+        np.testing.assert_allclose(scores, expected, rtol=1e-9, atol=1e-12)
+
+    def test_repeated_query_terms(self):
+        """Un terme répété dans la requête compte autant de fois qu'il apparaît."""
+        once = self.index.get_scores(["chiffre"])
+        twice = self.index.get_scores(["chiffre", "chiffre"])
+
+        np.testing.assert_allclose(twice, 2 * once)
+
+    def test_unknown_terms_score_zero(self):
+        """Une requête sans terme connu donne des scores nuls pour tous les documents."""
+        scores = self.index.get_scores(["inconnu", "absent"])
+
+        assert scores.shape == (len(CORPUS),)
+        assert not scores.any()
+
+
+class TestReciprocalRankFusion:
+    """Tests pour la fusion RRF sur l'union des candidats."""
+
+    def setup_method(self):
+        """Retriever sans index ni vector store : seule la fusion est testée."""
+        self.retriever = HybridRetriever.__new__(HybridRetriever)
+        self.retriever.alpha = 0.5
+
+    def _expected(self, bm25_indices, semantic_indices, k=60):
+        """RRF de référence, calculée document par document."""
+        alpha = self.retriever.alpha
+        expected = {}
+        for rank, idx in enumerate(bm25_indices[:RRF_CANDIDATES]):
+            expected[idx] = expected.get(idx, 0.0) + (1 - alpha) / (k + rank)
+        for rank, idx in enumerate(semantic_indices):
+            expected[idx] = expected.get(idx, 0.0) + alpha / (k + rank)
+        return expected
+
+    def test_union_of_candidates(self):
+        """Chaque document reçoit la somme des contributions des classements où il figure."""
+        bm25 = np.array([3, 1, 7])
+        semantic = np.array([1, 5, 3])
+
+        candidates, fused = self.retriever._reciprocal_rank_fusion(bm25, semantic)
+
+        expected = self._expected(bm25.tolist(), semantic.tolist())
+        assert candidates.tolist() == sorted(expected)
+        np.testing.assert_allclose(fused, [expected[i] for i in candidates.tolist()], rtol=1e-6)
+
+    def test_duplicate_content_ranked_once(self):
+        """Des contenus identiques renvoyés plusieurs fois par Chroma ne sont classés qu'une fois chacun."""
+        retriever = self.retriever
+        retriever.documents = [Document(page_content=text) for text in
+                               ["doublon", "unique", "doublon", "autre", "doublon"]]
+        retriever.k = 2
+        retriever._hash_to_idx = {}
+        for i, doc in enumerate(retriever.documents):
+            retriever._hash_to_idx.setdefault(xxhash.xxh3_64_intdigest(doc.page_content), []).append(i)
+        retriever.embed_query = Mock(return_value=[0.0])
+        retriever.vector_store = Mock()
+        retriever.vector_store.similarity_search_by_vector_with_relevance_scores.return_value = [
+            (Document(page_content="doublon"), 0.1),
+            (Document(page_content="doublon"), 0.1),
+            (Document(page_content="unique"), 0.2),
+            (Document(page_content="doublon"), 0.1),
+            (Document(page_content="autre"), 0.3),
+        ]
+
+        semantic_indices, scores = retriever._get_semantic_scores("requête")
+
+        assert semantic_indices.tolist() == [0, 2, 4, 1, 3]
+        assert len(scores) == len(semantic_indices)
+
+        candidates, fused = retriever._reciprocal_rank_fusion(np.array([1]), semantic_indices)
+        expected = self._expected([1], semantic_indices.tolist())
+        assert candidates.tolist() == [0, 1, 2, 3, 4]
+        np.testing.assert_allclose(fused, [expected[i] for i in candidates.tolist()], rtol=1e-6)
+
+    def test_bm25_truncated_to_rrf_candidates(self):
+        """Au-delà de RRF_CANDIDATES, les documents BM25 ne sont pas fusionnés."""
+        bm25 = np.arange(RRF_CANDIDATES + 10)
+        semantic = np.array([], dtype=np.int64)
+
+        candidates, fused = self.retriever._reciprocal_rank_fusion(bm25, semantic)
+
+        assert len(candidates) == RRF_CANDIDATES
+        assert fused[0] > fused[-1] > 0
@@ -0,0 +1,57 @@
+"""
+Tests pour l'expansion de requêtes par synonymes.
+"""
+
+from app.core.multimodal_processor import QueryExpander
+
+
+class TestQueryExpander:
+    """Tests pour QueryExpander.expand_with_synonyms."""
+
+    def setup_method(self):
+        """Configuration avant chaque test."""
+        self.expander = QueryExpander()
+
+    def test_no_known_term(self):
+        """Sans terme du dictionnaire, seule la requête originale est renvoyée."""
+        query = "Quelle est la météo demain ?"
+
+        assert self.expander.expand_with_synonyms(query) == [query]
+
+    def test_single_term_variations(self):
+        """Une variation par synonyme, dans l'ordre du dictionnaire, après la requête originale."""
+        query = "Quel est le bénéfice 2023 ?"
+
+        variations = self.expander.expand_with_synonyms(query)
+
+        assert variations == [
+            query,
+            "Quel est le profit 2023 ?",
+            "Quel est le résultat net 2023 ?",
+            "Quel est le gains 2023 ?",
+        ]
+
+    def test_case_insensitive_match(self):
+        """Les termes sont reconnus quelle que soit la casse de la requête."""
+        variations = self.expander.expand_with_synonyms("RISQUE majeur")
+
+        assert "Danger majeur" in variations
+        assert "Exposition majeur" in variations
+
+    def test_multi_word_term(self):
+        """Un terme de plusieurs mots est remplacé en entier."""
+        variations = self.expander.expand_with_synonyms("Évolution du chiffre d'affaires")
+
+        assert "évolution du revenus".capitalize() in variations
+        assert all("chiffre d'affaires" not in v for v in variations[1:])
+
+    def test_multiple_terms_replaced_together(self):
+        """Chaque variation remplace tous les termes trouvés, sans doublon."""
+        query = "Risque client"
+
+        variations = self.expander.expand_with_synonyms(query)
+
+        assert variations[0] == query
+        assert "Danger consommateur" in variations
+        assert all("risque" not in v.lower() and "client" not in v.lower() for v in variations[1:])
+        assert len(variations) == len(set(variations))
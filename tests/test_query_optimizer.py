@@ -0,0 +1,29 @@
+"""
+Tests pour l'analyse des listes numérotées renvoyées par le LLM.
+"""
+
+from app.core.query_optimizer import _list_items
+
+
+class TestListItems:
+    """Tests pour _list_items (variations et sous-questions)."""
+
+    def test_numbering_removed(self):
+        """Les préfixes "1." / "2)" / "-" sont retirés, sans blanc résiduel."""
+        content = "1. Quel est le CA en 2023 ?\n2) Quels sont les revenus ?\n- Quelles sont les ventes ?"
+
+        assert _list_items(content) == [
+            "Quel est le CA en 2023 ?",
+            "Quels sont les revenus ?",
+            "Quelles sont les ventes ?",
+        ]
+
+    def test_short_item_keeps_no_leading_space(self):
+        """Une ligne juste au-dessus du seuil est nettoyée comme les autres."""
+        assert _list_items("1. Pourquoi?") == ["Pourquoi?"]
+
+    def test_short_and_separator_lines_skipped(self):
+        """Lignes courtes, vides et séparateurs réduits au préfixe sont ignorés."""
+        content = "Voici :\n\n----------\n-----------------\n  1. Quelle stratégie à 3 ans ?  \r"
+
+        assert _list_items(content) == ["Quelle stratégie à 3 ans ?"]
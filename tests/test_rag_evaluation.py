@@ -61,6 +61,28 @@ class TestRAGEvaluator:
         assert "rouge2" in result.rouge_scores
         assert "rougeL" in result.rouge_scores
 
+    def test_rouge_matches_default_scorer(self):
+        """La tokenisation mémoïsée donne les mêmes scores ROUGE que le scorer par défaut."""
+        from rouge_score import rouge_scorer
+        reference_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+        reference = "Le CA de l'entreprise atteint 100 millions d'euros en 2023."
+        
+        for answer in [self.sample_answer, "Les revenus augmentent fortement.", reference]:
+            expected = reference_scorer.score(reference, answer)
+            scores = self.evaluator._calculate_rouge_scores(answer, reference)
+            for key in ('rouge1', 'rouge2', 'rougeL'):
+                assert scores[key] == pytest.approx(expected[key].fmeasure)
+
+    def test_rouge_reference_tokenized_once(self):
+        """Une même référence évaluée contre plusieurs réponses n'est tokenisée qu'une fois."""
+        tokenizer = self.evaluator.rouge_tokenizer
+        reference = "Référence partagée par plusieurs réponses candidates."
+        
+        for answer in ["Première réponse candidate.", "Deuxième réponse candidate."]:
+            self.evaluator._calculate_rouge_scores(answer, reference)
+        
+        assert tokenizer._tokenize.cache_info().hits >= 1
+
     def test_heuristic_relevance(self):
         """Test de la méthode heuristique de pertinence."""
         # Question et réponse avec beaucoup de mots en commun
@@ -120,6 +142,31 @@ class TestRAGEvaluator:
             
             # L'évaluateur doit retourner des scores par défaut
             assert result.overall_score == 0.5
+            assert result.degraded is True
+
+    def test_llm_failure_marks_result_degraded(self):
+        """Un juge LLM en échec (scores heuristiques de repli) marque le résultat comme dégradé."""
+        self.evaluator.llm_evaluator = Mock()
+        self.evaluator.llm_evaluator.invoke.side_effect = Exception("Rate limit")
+        
+        result = self.evaluator.evaluate_response(
+            question=self.sample_question,
+            answer=self.sample_answer,
+            sources=self.sample_sources
+        )
+        
+        assert result.degraded is True
+        assert 0.0 <= result.relevance_score <= 1.0
+
+    def test_heuristic_judge_not_degraded(self):
+        """Sans juge LLM configuré, les heuristiques sont le juge prévu : pas de dégradation."""
+        result = self.evaluator.evaluate_response(
+            question=self.sample_question,
+            answer=self.sample_answer,
+            sources=self.sample_sources
+        )
+        
+        assert result.degraded is False
 
 class TestMetricsCollector:
     """Tests pour le collecteur de métriques."""
@@ -8,12 +8,16 @@ import os
 import json
 from unittest.mock import Mock, patch
 from pathlib import Path
+from dataclasses import asdict
+from datetime import datetime
 
 from app.core.rag_evaluation_suite import (
     RAGEvaluationSuite,
     TestCase,
-    TestResult
+    TestResult,
+    JUDGE_CACHE_TTL
 )
+from app.core.evaluation import EvaluationResult
 from app.core.advanced_rag import AdvancedRAGPipeline
 
 
@@ -137,6 +141,28 @@ class TestRAGEvaluationSuite:
         assert "average_scores" in summary
         assert summary["avg_response_time"] == 1.25
 
+    def test_generate_summary_memo_invalidation(self):
+        """Le résumé mémoïsé suit les remplacements de résultats et n'est pas partagé."""
+        self.evaluation_suite.results = [
+            TestResult("TC001", "Q1", "A1", None, {"overall": 0.8}, True, timestamp="2024-01-01T00:00:00"),
+            TestResult("TC002", "Q2", "A2", None, {"overall": 0.5}, False, timestamp="2024-01-01T00:00:00")
+        ]
+        
+        summary = self.evaluation_suite._generate_summary(0)
+        assert summary["passed_count"] == 1
+        
+        # Modifier le résumé renvoyé n'altère pas les appels suivants
+        summary["failed_test_ids"].append("TC999")
+        assert self.evaluation_suite._generate_summary(0)["failed_test_ids"] == ["TC002"]
+        
+        # Remplacement en place d'un résultat : le résumé est recalculé
+        self.evaluation_suite.results[1] = TestResult(
+            "TC002", "Q2", "A2", None, {"overall": 0.9}, True, timestamp="2024-01-01T00:00:00"
+        )
+        summary = self.evaluation_suite._generate_summary(0)
+        assert summary["passed_count"] == 2
+        assert summary["failed_test_ids"] == []
+
     def test_get_results_by_category(self):
         """Test de regroupement des résultats par catégorie."""
         # Ajouter des test cases
@@ -211,6 +237,33 @@ class TestRAGEvaluationSuite:
             if os.path.exists(output_file):
                 os.remove(output_file)
 
+    def test_export_results_json_roundtrip(self, tmp_path):
+        """Le JSON écrit résultat par résultat se relit à l'identique (accents compris)."""
+        self.evaluation_suite.results = [
+            TestResult("TC001", "Quel est le CA ?", "100 M€ en 2023", "Le CA est de 100 M€",
+                       {"overall": 0.8}, True, response_time=1.0, timestamp="2024-01-01T00:00:00"),
+            TestResult("TC002", "Q2 \"citée\"", "", None, {}, False,
+                       error="Délai dépassé", timestamp="2024-01-01T00:00:01")
+        ]
+        
+        filepath = self.evaluation_suite.export_results_json(str(tmp_path / "results.json"))
+        
+        with open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        assert data["test_results"] == [asdict(r) for r in self.evaluation_suite.results]
+        assert data["summary"]["total_tests"] == 2
+
+    def test_export_results_json_empty(self, tmp_path):
+        """Sans résultats, le fichier reste un JSON valide avec une liste vide."""
+        filepath = self.evaluation_suite.export_results_json(str(tmp_path / "results.json"))
+        
+        with open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        assert data["test_results"] == []
+        assert data["summary"] == {}
+
     @pytest.mark.skipif(not os.getenv("RUN_INTEGRATION_TESTS"), 
                        reason="Tests d'intégration désactivés par défaut")
     def test_full_evaluation_integration(self):
@@ -220,6 +273,82 @@ class TestRAGEvaluationSuite:
         pass
 
 
+class TestJudgeCache:
+    """Tests pour le cache disque des scores du juge."""
+    
+    def setup_method(self):
+        """Configuration avant chaque test."""
+        self.evaluation_suite = RAGEvaluationSuite()
+        self.test_case = TestCase(id="TC001", question="Quel est le CA ?", expected_answer="100 M€")
+        self.sources = [{"content": "Source A"}, {"content": "Source B"}]
+
+    def test_key_ignores_source_order(self):
+        """L'ordre des sources n'influe pas sur la clé."""
+        key = self.evaluation_suite._judge_cache_key(self.test_case, "100 M€", self.sources)
+        reordered = self.evaluation_suite._judge_cache_key(self.test_case, "100 M€", self.sources[::-1])
+        
+        assert key is not None
+        assert key == reordered
+
+    def test_key_depends_on_inputs(self):
+        """Réponse, sources, référence et modèle juge changent la clé."""
+        suite = self.evaluation_suite
+        key = suite._judge_cache_key(self.test_case, "100 M€", self.sources)
+        
+        assert suite._judge_cache_key(self.test_case, "200 M€", self.sources) != key
+        assert suite._judge_cache_key(self.test_case, "100 M€", self.sources[:1]) != key
+        other_reference = TestCase(id="TC001", question="Quel est le CA ?", expected_answer="200 M€")
+        assert suite._judge_cache_key(other_reference, "100 M€", self.sources) != key
+        
+        suite.evaluator.llm_evaluator = Mock(temperature=0, model_name="gpt-4o")
+        assert suite._judge_cache_key(self.test_case, "100 M€", self.sources) != key
+
+    def test_no_key_for_sampling_judge(self):
+        """Un juge à température > 0 n'est pas déterministe : pas de mise en cache."""
+        self.evaluation_suite.evaluator.llm_evaluator = Mock(temperature=0.7, model_name="gpt-4o")
+        
+        assert self.evaluation_suite._judge_cache_key(self.test_case, "100 M€", self.sources) is None
+
+    def test_cached_scores_skip_evaluation(self):
+        """Un score en cache est réutilisé sans rappeler l'évaluateur."""
+        cached_scores = {"overall": 0.9, "relevance": 0.9, "faithfulness": 0.9,
+                         "context_precision": 0.9, "context_recall": 0.9}
+        rag_output = {"test_case": self.test_case, "answer": "100 M€", "sources": self.sources,
+                      "response_time": 1.0, "error": None}
+        
+        with patch("app.core.rag_evaluation_suite.judge_cache") as mock_cache, \
+             patch.object(self.evaluation_suite.evaluator, "evaluate_batch") as mock_eval:
+            mock_cache.get.return_value = cached_scores
+            
+            results = self.evaluation_suite._score_batch([rag_output], use_cache=True)
+        
+        mock_eval.assert_not_called()
+        assert results[0].evaluation_scores == cached_scores
+        assert results[0].passed is True
+
+
+    def test_degraded_scores_not_cached(self):
+        """Les scores de repli ne sont pas écrits dans le cache ; les autres le sont avec une expiration."""
+        rag_output = {"test_case": self.test_case, "answer": "100 M€", "sources": self.sources,
+                      "response_time": 1.0, "error": None}
+        
+        def eval_result(degraded):
+            return EvaluationResult(0.5, 0.5, 0.5, 0.5, {}, 0.5, 0.1, datetime.utcnow(), degraded=degraded)
+        
+        with patch("app.core.rag_evaluation_suite.judge_cache") as mock_cache, \
+             patch.object(self.evaluation_suite.evaluator, "evaluate_batch") as mock_eval:
+            mock_cache.get.return_value = None
+            
+            mock_eval.return_value = [eval_result(True)]
+            self.evaluation_suite._score_batch([rag_output], use_cache=True)
+            mock_cache.set.assert_not_called()
+            
+            mock_eval.return_value = [eval_result(False)]
+            self.evaluation_suite._score_batch([rag_output], use_cache=True)
+            mock_cache.set.assert_called_once()
+            assert mock_cache.set.call_args.kwargs["expire"] == JUDGE_CACHE_TTL
+
+
 class TestQualityThresholds:
     """Tests pour vérifier que le système maintient des seuils de qualité."""
     